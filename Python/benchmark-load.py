@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+"""
+Measure how the bots behave under load.
+
+Every bot is started on localhost, with some data generated on purpose in
+a temporary directory, then it receives a mix of slash command requests,
+similar to those of Mattermost, from a given number of concurrent clients.
+For every bot and number of clients, the throughput and the percentiles
+of the latency are printed and appended, as one JSON object per line, to
+an output file, so that different runs can be compared.
+
+hindexslash.py is run against a simulated Scopus, with the lookups done
+synchronously, so that the latency includes that of Scopus.
+
+Note that the clients are threads of this process, which may become the
+bottleneck with many clients: use --client_processes to spread them over
+multiple processes, not to be confused with --processes, i.e., the worker
+processes of the bots.
+
+Example:
+
+./benchmark-load.py --bots memeslash cceslash --clients 1 8 32 --requests 2000
+"""
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import socket
+import string
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlencode
+
+import slashserver
+from persdicpool import SUFFIXES
+from persdicstorage import STORAGES, make_storage
+
+TOKEN = "benchmark"
+BUSY = slashserver.BUSY_TEXT.encode("utf-8")
+BOTS = ["memeslash", "cceslash", "cerino", "hindexslash"]
+COMMANDS = {
+    "memeslash": "/meme",
+    "cceslash": "/cce",
+    "cerino": "/cerino",
+    "hindexslash": "/hindex",
+}
+
+
+def random_word(rng, min_length, max_length):
+    """Return a random lowercase word"""
+
+    return "".join(
+        rng.choice(string.ascii_lowercase)
+        for _ in range(rng.randint(min_length, max_length))
+    )
+
+
+def typo(rng, word):
+    """Return a word with one character replaced"""
+
+    i = rng.randrange(len(word))
+    return word[:i] + rng.choice(string.ascii_lowercase) + word[i + 1 :]
+
+
+def setup(bot, directory, rng, args):
+    """Generate the data of a bot, return its command-line arguments and the
+    list of words used to generate the requests"""
+
+    entries = args.entries
+
+    if bot == "memeslash":
+        keys = list({random_word(rng, 4, 16) for _ in range(entries)})
+        content = {x: f"https://example.com/{x}.gif" for x in keys}
+        filename = os.path.join(directory, "memes" + SUFFIXES[args.meme_storage])
+        storage = make_storage(args.meme_storage, filename)
+        storage.write([["add", k, v] for k, v in content.items()], content)
+        storage.close()
+        return ["--persistence", filename, "--storage", args.meme_storage], keys
+
+    if bot == "cceslash":
+        names = list(
+            {f"{random_word(rng, 3, 8)}.{random_word(rng, 4, 10)}" for _ in range(entries)}
+        )
+        filename = os.path.join(directory, "names")
+        with open(filename, "w") as outfile:
+            outfile.write("\n".join(names) + "\n")
+        return ["--names", filename], names
+
+    if bot == "hindexslash":
+        eids = [str(rng.randint(10 ** 9, 10 ** 10)) for _ in range(entries)]
+        return [
+            "--fake_latency",
+            str(args.scopus_latency),
+            "--deferred_workers",
+            "0",
+        ], eids
+
+    return [], []
+
+
+def make_text(bot, rng, words):
+    """Return the text of a random request to a bot"""
+
+    p = rng.random()
+
+    if bot == "memeslash":
+        word = rng.choice(words)
+        if p < 0.5:
+            return word
+        if p < 0.7:
+            return word[: rng.randint(3, len(word))]
+        if p < 0.8:
+            return typo(rng, word)
+        if p < 0.9:
+            return f"list {word[:2]}"
+        if p < 0.95:
+            return f"add {random_word(rng, 4, 16)} https://example.com/new.gif"
+        return random_word(rng, 4, 16)
+
+    if bot == "cceslash":
+        name = rng.choice(words)
+        if p < 0.3:
+            return name
+        if p < 0.7:
+            return name.split(".")[rng.randint(0, 1)]
+        start = rng.randrange(len(name) - 2)
+        return name[start : start + rng.randint(3, 5)]
+
+    if bot == "cerino":
+        return rng.choice(["die", "coin", "U(1,100)", "bingo", "alice bob carol"])
+
+    if bot == "hindexslash":
+        if p < 0.7:
+            return f"get {rng.choice(words)}"
+        if p < 0.9:
+            return "get " + " ".join(rng.sample(words, 3))
+        return f"get {random_word(rng, 4, 8)} {random_word(rng, 4, 10)}"
+
+    raise ValueError(f"Unknown bot: {bot}")
+
+
+def make_body(command, text, rng):
+    """Return the body of a slash command request, as sent by Mattermost"""
+
+    return urlencode(
+        dict(
+            channel_id=random_word(rng, 26, 26),
+            channel_name="town-square",
+            command=command,
+            response_url="http://localhost:1/hooks/commands/none",
+            team_domain="example",
+            team_id=random_word(rng, 26, 26),
+            text=text,
+            token=TOKEN,
+            user_id=random_word(rng, 26, 26),
+            user_name="someone",
+        )
+    ).encode("utf-8")
+
+
+def wait_ready(port, process, log, timeout=30.0):
+    """Wait until a bot accepts connections on a local port"""
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            with open(log, "r") as infile:
+                raise RuntimeError(f"Bot exited while starting:\n{infile.read()}")
+        try:
+            socket.create_connection(("localhost", port), timeout=1.0).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Bot not listening on port {port} after {timeout} s")
+
+
+def send(conn, body, keep_alive):
+    """Send a request, return its latency, in s, HTTP status code, and
+    whether the bot answered that the command is busy"""
+
+    start = time.perf_counter()
+    try:
+        conn.request(
+            "POST",
+            "/",
+            body=body,
+            headers={"Content-Type": "application/x-www-form-urlencoded"},
+        )
+        response = conn.getresponse()
+        busy = BUSY in response.read()
+        status = response.status
+    except (OSError, http.client.HTTPException):
+        status = 0
+        busy = False
+        keep_alive = False
+    finally:
+        if not keep_alive:
+            conn.close()
+    return time.perf_counter() - start, status, busy
+
+
+def run_clients(port, bodies, clients, keep_alive=False):
+    """Send the requests from a number of concurrent threads, return the
+    list of latencies, the number of errors, and that of busy responses.
+
+    If keep_alive is true then every thread sends all its requests on the
+    same connection, as long as the server keeps it open, otherwise it
+    opens a new connection for every request.
+    """
+
+    latencies = []
+    errors = [0]
+    busy = [0]
+    lock = threading.Lock()
+    pending = iter(bodies)
+
+    def client():
+        conn = http.client.HTTPConnection("localhost", port, timeout=60)
+        while True:
+            with lock:
+                body = next(pending, None)
+            if body is None:
+                conn.close()
+                return
+            latency, status, shed = send(conn, body, keep_alive)
+            with lock:
+                latencies.append(latency)
+                errors[0] += status != 200
+                busy[0] += shed
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0], busy[0]
+
+
+def percentile(values, p):
+    """Return the p-th percentile of a sorted list of values"""
+
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def measure(port, bodies, clients, processes, keep_alive):
+    """Return the statistics of the requests sent to a bot"""
+
+    start = time.perf_counter()
+    if processes == 1:
+        latencies, errors, busy = run_clients(port, bodies, clients, keep_alive)
+    else:
+        latencies = []
+        errors = 0
+        busy = 0
+        with ProcessPoolExecutor(processes) as executor:
+            futures = [
+                executor.submit(
+                    run_clients,
+                    port,
+                    bodies[i::processes],
+                    max(1, clients // processes),
+                    keep_alive,
+                )
+                for i in range(processes)
+            ]
+            for future in futures:
+                result = future.result()
+                latencies += result[0]
+                errors += result[1]
+                busy += result[2]
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return dict(
+        requests=len(latencies),
+        errors=errors,
+        busy=busy,
+        duration=elapsed,
+        throughput=len(latencies) / elapsed,
+        p50=percentile(latencies, 50),
+        p95=percentile(latencies, 95),
+        p99=percentile(latencies, 99),
+        max=latencies[-1],
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        "Benchmark the bots under load",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--bots", type=str, nargs="+", default=BOTS, choices=BOTS, help="Bots to run."
+    )
+    parser.add_argument(
+        "--clients",
+        type=int,
+        nargs="+",
+        default=[1, 8, 32],
+        help="Numbers of concurrent clients.",
+    )
+    parser.add_argument(
+        "--requests", type=int, default=2000, help="Requests per run."
+    )
+    parser.add_argument(
+        "--warmup", type=int, default=100, help="Requests before every run."
+    )
+    parser.add_argument(
+        "--keep_alive",
+        action="store_true",
+        default=False,
+        help="Send the requests of every client on a persistent connection.",
+    )
+    parser.add_argument(
+        "--client_processes",
+        type=int,
+        default=1,
+        help="Processes sending requests.",
+    )
+    parser.add_argument(
+        "--entries", type=int, default=10000, help="Entries in the data of the bots."
+    )
+    parser.add_argument(
+        "--meme_storage",
+        type=str,
+        default="json",
+        choices=list(STORAGES.keys()),
+        help="Storage backend of memeslash.",
+    )
+    parser.add_argument(
+        "--scopus_latency",
+        type=float,
+        default=0.05,
+        help="Average latency, in s, of the simulated Scopus.",
+    )
+    parser.add_argument("--port", type=int, default=10900, help="Port of the bots.")
+    parser.add_argument(
+        "--bot_args",
+        type=str,
+        default="",
+        help="Additional command-line arguments of the bots, e.g., '--journal'.",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default="benchmark-load.jsonl",
+        help="File where to append the results.",
+    )
+    parser.add_argument("--seed", type=int, default=42, help="Random seed.")
+    slashserver.add_arguments(parser)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    server_args = []
+    for name, value in slashserver.options(args).items():
+        server_args += [f"--{name}", str(value)]
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    print(
+        "bot          clients  req/s     p50 [ms]  p95 [ms]  p99 [ms]  errors  busy"
+    )
+    with open(args.output, "a") as output, tempfile.TemporaryDirectory() as directory:
+        for bot in args.bots:
+            bot_args, words = setup(bot, directory, rng, args)
+
+            log = os.path.join(directory, f"{bot}.log")
+            process = subprocess.Popen(
+                [
+                    sys.executable,
+                    os.path.join(here, f"{bot}.py"),
+                    "--port",
+                    str(args.port),
+                    "--token",
+                    TOKEN,
+                ]
+                + server_args
+                + bot_args
+                + args.bot_args.split(),
+                stdout=subprocess.DEVNULL,
+                stderr=open(log, "w"),
+            )
+            try:
+                wait_ready(args.port, process, log)
+                for clients in args.clients:
+                    command = COMMANDS[bot]
+                    bodies = [
+                        make_body(command, make_text(bot, rng, words), rng)
+                        for _ in range(args.warmup + args.requests)
+                    ]
+                    run_clients(
+                        args.port, bodies[: args.warmup], clients, args.keep_alive
+                    )
+                    stats = measure(
+                        args.port,
+                        bodies[args.warmup :],
+                        clients,
+                        args.client_processes,
+                        args.keep_alive,
+                    )
+
+                    print(
+                        f"{bot:<12} {clients:<8} {stats['throughput']:<9.1f} "
+                        f"{stats['p50'] * 1e3:<9.2f} {stats['p95'] * 1e3:<9.2f} "
+                        f"{stats['p99'] * 1e3:<9.2f} {stats['errors']:<7} "
+                        f"{stats['busy']}"
+                    )
+                    record = dict(
+                        time=time.strftime("%Y-%m-%dT%H:%M:%S"),
+                        bot=bot,
+                        clients=clients,
+                        mode=args.mode,
+                        workers=args.workers,
+                        processes=args.processes,
+                        command_limit=args.command_limit,
+                        command_queue=args.command_queue,
+                        keep_alive=args.keep_alive,
+                        entries=args.entries,
+                        meme_storage=args.meme_storage,
+                        bot_args=args.bot_args,
+                        python=platform.python_version(),
+                        **stats,
+                    )
+                    output.write(json.dumps(record) + "\n")
+                    output.flush()
+            finally:
+                process.terminate()
+                process.wait()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Measure the time to decode the body of a slash command request with
+mattermostrequest.parse(), compared to parse_qs followed by the field by
+field assignment that MattermostRequest did before.
+
+Example:
+
+./benchmark-parse.py --requests 100000
+"""
+
+import argparse
+import time
+from urllib.parse import parse_qs, urlencode
+
+from mattermostrequest import FIELDS, parse
+
+
+class LegacyRequest(object):
+    """MattermostRequest as it was before, with a list per field"""
+
+    def __init__(self, mmdata):
+        for key in FIELDS:
+            setattr(self, key, None)
+        for key, value in mmdata.items():
+            if key == "response_url":
+                self.response_url = value
+            elif key == "text":
+                self.text = value
+            elif key == "token":
+                self.token = value
+            elif key == "channel_id":
+                self.channel_id = value
+            elif key == "team_id":
+                self.team_id = value
+            elif key == "command":
+                self.command = value
+            elif key == "team_domain":
+                self.team_domain = value
+            elif key == "user_name":
+                self.user_name = value
+            elif key == "channel_name":
+                self.channel_name = value
+
+
+def make_body(text):
+    """Return the body of a request similar to those sent by Mattermost"""
+
+    return urlencode(
+        dict(
+            channel_id="fukxanjgjbnp7ng383at53k1sy",
+            channel_name="town-square",
+            command="/meme",
+            response_url="https://mattermost.example.com/hooks/commands/"
+            "8jbazq9osfrk8bhfbbkqsqhz4e",
+            team_domain="example",
+            team_id="4ctgrb1nctyzfp4qpz6ubwpw6h",
+            text=text,
+            token="xr3j5x3p4pfk7kx3aahtdyqwzh",
+            trigger_id="OWZkOHFmMXhsYnJ5ZmpzcjRhOTRrOWR4N3I6dTFrZHphYnR6ZmZ4Yg==",
+            user_id="u1kdzabtzffxbpjkzsgnf1wh6g",
+            user_name="someone",
+        )
+    )
+
+
+def measure(func, bodies):
+    """Return the average time, in us, to execute func on every body"""
+
+    start = time.perf_counter()
+    for body in bodies:
+        func(body)
+    return (time.perf_counter() - start) / len(bodies) * 1e6
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        "Benchmark the decoding of slash command requests",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--requests", type=int, default=100000, help="Number of requests per run."
+    )
+    args = parser.parse_args()
+
+    print("text                 legacy [us]  parse [us]  speedup")
+    for text in ["", "facepalm", "add lol https://example.com/lol.gif", "é" * 100]:
+        body = make_body(text)
+        legacy = LegacyRequest(parse_qs(body))
+        request = parse(body)
+        for key in FIELDS:
+            assert getattr(legacy, key) in (None, [getattr(request, key)]) or (
+                key == "text" and not text
+            )
+
+        bodies = [body] * args.requests
+        before = measure(lambda x: LegacyRequest(parse_qs(x)), bodies)
+        after = measure(parse, bodies)
+        print(
+            f"{text[:20]:<20} {before:<12.2f} {after:<11.2f} {before / after:.1f}x"
+        )
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Measure the time and memory needed to import the modules of the bots, each
+in a fresh interpreter, i.e., what is paid at every (re)start of a bot.
+
+The modules listed with --lazy must not be imported at startup: if any of
+them is, or if a threshold is exceeded, the script exits with an error, so
+that it can be used to catch regressions.
+
+Example:
+
+./benchmark-startup.py --runs 5 --max_time 0.5
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+MODULES = ["hindexslash", "hindex", "eid", "memeslash", "cceslash", "cerino", "mmbots"]
+LAZY = ["pandas", "numpy", "requests"]
+
+CHILD = """
+import json, resource, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    "time": elapsed,
+    "rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "lazy": [x for x in {lazy!r} if x in sys.modules],
+}}))
+"""
+
+
+def measure(module, lazy):
+    """Return the import time, in s, the max RSS, in KiB, and the lazy
+    modules imported, of a module imported in a new interpreter"""
+
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD.format(module=module, lazy=lazy)],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    result = json.loads(output)
+    return result["time"], result["rss"], result["lazy"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        "Benchmark the startup time and memory of the bots",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--modules", type=str, nargs="+", default=MODULES, help="Modules to import."
+    )
+    parser.add_argument(
+        "--lazy",
+        type=str,
+        nargs="*",
+        default=LAZY,
+        help="Modules that must not be imported at startup.",
+    )
+    parser.add_argument("--runs", type=int, default=5, help="Runs per module.")
+    parser.add_argument(
+        "--max_time",
+        type=float,
+        default=0.0,
+        help="Maximum median import time, in s, 0 for no limit.",
+    )
+    parser.add_argument(
+        "--max_rss",
+        type=int,
+        default=0,
+        help="Maximum median RSS, in MiB, 0 for no limit.",
+    )
+    args = parser.parse_args()
+
+    failures = []
+    print("module        time [ms]  RSS [MiB]  lazy modules imported")
+    for module in args.modules:
+        times = []
+        rsss = []
+        imported = set()
+        for _ in range(args.runs):
+            elapsed, rss, lazy = measure(module, args.lazy)
+            times.append(elapsed)
+            rsss.append(rss / 1024)
+            imported.update(lazy)
+
+        elapsed = statistics.median(times)
+        rss = statistics.median(rsss)
+        print(
+            f"{module:<13} {elapsed * 1e3:<10.1f} {rss:<10.1f} "
+            f"{', '.join(sorted(imported)) or '-'}"
+        )
+
+        if imported:
+            failures.append(f"{module} imports {', '.join(sorted(imported))}")
+        if args.max_time > 0 and elapsed > args.max_time:
+            failures.append(f"{module} takes {elapsed:.3f} s to import")
+        if args.max_rss > 0 and rss > args.max_rss:
+            failures.append(f"{module} uses {rss:.1f} MiB after import")
+
+    for failure in failures:
+        print(f"Error: {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Compare the partial match lookup via NgramIndex with a linear scan of the
+keys, i.e., what PersDic.get(exact=False) did before the index was added.
+
+Since the index is updated at every change of a PersDic, the time to add
+an entry to a PersDic with the given number of keys is also measured, with
+the storages whose writes do not depend on the size of the dictionary,
+i.e., json in journal mode and sqlite.
+
+Example:
+
+./benchmark-substring.py --sizes 10000 100000 --queries 1000
+"""
+
+import argparse
+import os
+import random
+import string
+import tempfile
+import time
+
+from ngramindex import NgramIndex, rank
+from persdic import PersDic
+from persdicpool import SUFFIXES
+from persdicstorage import make_storage
+
+
+def random_key(rng, min_length, max_length):
+    """Return a random key made of lowercase letters and some separators"""
+
+    alphabet = string.ascii_lowercase + "_-"
+    return "".join(
+        rng.choice(alphabet) for _ in range(rng.randint(min_length, max_length))
+    )
+
+
+def linear_first(keys, query):
+    """Return the first key containing the query with a linear scan"""
+
+    return min((k for k in keys if query in k), key=rank, default=None)
+
+
+def measure_add(storage, keys, adds, directory):
+    """Return the average time, in us, to add an entry to a PersDic with
+    the given keys"""
+
+    filename = os.path.join(directory, f"{len(keys)}{SUFFIXES[storage]}")
+    initial = make_storage(storage, filename)
+    content = {k: f"https://example.com/{k}.gif" for k in keys}
+    initial.write([["add", k, v] for k, v in content.items()], content)
+    initial.close()
+
+    options = dict(journal=True, compact_every=10 ** 9) if storage == "json" else {}
+    pers_dic = PersDic(filename, storage, **options)
+    try:
+        start = time.perf_counter()
+        for i in range(adds):
+            pers_dic.add(f"new_{i}_{keys[i % len(keys)]}", "https://example.com/new.gif")
+        return (time.perf_counter() - start) / adds * 1e6
+    finally:
+        pers_dic.close()
+
+
+def measure(func, queries):
+    """Return the average time, in us, to execute func on every query"""
+
+    start = time.perf_counter()
+    for query in queries:
+        func(query)
+    return (time.perf_counter() - start) / len(queries) * 1e6
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        "Benchmark the substring index against a linear scan",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[10000, 100000],
+        help="Number of keys.",
+    )
+    parser.add_argument(
+        "--queries", type=int, default=1000, help="Number of queries per run."
+    )
+    parser.add_argument(
+        "--query_lengths",
+        type=int,
+        nargs="+",
+        default=[2, 3, 5, 8],
+        help="Lengths of the queries.",
+    )
+    parser.add_argument(
+        "--adds", type=int, default=1000, help="Number of entries added per run."
+    )
+    parser.add_argument("--seed", type=int, default=42, help="Random seed.")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+
+    print("keys    qlen  build [s]  linear [us]  index [us]  speedup")
+    all_keys = dict()
+    for size in args.sizes:
+        keys = list({random_key(rng, 5, 20) for _ in range(size)})
+        all_keys[size] = keys
+
+        start = time.perf_counter()
+        index = NgramIndex(keys)
+        build = time.perf_counter() - start
+
+        for query_length in args.query_lengths:
+            # half of the queries are substrings of existing keys
+            queries = []
+            for i in range(args.queries):
+                if i % 2 == 0:
+                    key = rng.choice(keys)
+                    offset = rng.randint(0, max(0, len(key) - query_length))
+                    queries.append(key[offset : offset + query_length])
+                else:
+                    queries.append(random_key(rng, query_length, query_length))
+
+            for query in queries[:100]:
+                assert index.first(query) == linear_first(keys, query)
+
+            linear = measure(lambda x: linear_first(keys, x), queries)
+            indexed = measure(index.first, queries)
+            print(
+                f"{size:<7} {query_length:<5} {build:<10.2f} {linear:<12.1f} "
+                f"{indexed:<11.1f} {linear / indexed:.1f}x"
+            )
+
+    print()
+    print("keys    storage  add [us]")
+    with tempfile.TemporaryDirectory() as directory:
+        for size, keys in all_keys.items():
+            for storage in ["json", "sqlite"]:
+                add = measure_add(storage, keys, args.adds, directory)
+                print(f"{size:<7} {storage:<8} {add:.1f}")
@@ -13,53 +13,149 @@ Mattermost documentation:
     http://docs.mattermost.com/developer/slash-commands.html
 """
 
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from urllib.parse import parse_qs
-import json
 import argparse
+import bisect
+import heapq
+import os
+import sys
+from collections import namedtuple
+from threading import Event, Thread
 
-from mattermostrequest import MattermostRequest
+import slashserver
+from ngramindex import NgramIndex, rank
 
-token = None
-names = set()
+LIMIT = 20
 
-# guarantee unicode string
-_u = lambda t: t.decode("UTF-8", "replace") if isinstance(t, str) else t
+Snapshot = namedtuple("Snapshot", ["index", "exact", "prefixes"])
 
 
-class PostHandler(BaseHTTPRequestHandler):
-    def do_POST(self):
-        """Respond to a POST request."""
+class NameDirectory(object):
+    """Names read from a file, one per line, e.g., 'name.surname'.
 
-        # Extract the contents of the POST
-        length = int(self.headers["Content-Length"])
-        post_data = parse_qs(self.rfile.read(length).decode("utf-8"))
+    Matches are ranked by class: first exact matches, i.e., the name or
+    one of its dot-separated parts is equal to the text; then prefix
+    matches, i.e., the name or one of its parts starts with the text; then
+    the other names containing the text. Within a class, shortest first.
 
-        # Get POST data and initialize MattermostRequest object
-        request = MattermostRequest(post_data)
+    Exact matches are found in a dictionary of the parts, prefix matches by
+    bisecting the sorted list of the parts, the others via their n-grams:
+    none of them requires a scan of all the names.
 
-        data = {}
+    The file is checked periodically in background and, if changed, the
+    names are loaded into new indexes, which then replace the old ones:
+    lookups in the meanwhile are served by the latter.
+    """
 
-        if request.command[0] != "/cce" or request.token[0] != token:
-            data["text"] = "invalid request"
-            self.send_response(401)
-            self.wfile.write(json.dumps(data).encode("utf-8"))
-            return
+    def __init__(self, filename, reload_interval=1.0):
+        """Load the names.
 
-        if not request.text:
-            responsetext = getcce("help")
-        else:
-            assert len(request.text) == 1
-            responsetext = getcce(request.text[0])
+        Parameters
+        ---------
+        filename : str
+            The name of the file containing the names
+
+        reload_interval : float
+            How often, in seconds, to check if the file has changed,
+            0 to never reload it
+        """
 
-        # Send response HTTP 200 (OK) to MM server
-        data["response_type"] = "ephemeral" if responsetext[1] else "in_channel"
-        data["text"] = responsetext[0]
-        self.send_response(200)
-        self.send_header("Content-type", "application/json")
-        self.end_headers()
-        self.wfile.write(json.dumps(data).encode("utf-8"))
+        self.filename = filename
+        self._stamp = None
+        self._snapshot = None
+        self.reload()
 
+        self._stopped = Event()
+        self._watcher = None
+        if reload_interval > 0:
+            self._watcher = Thread(
+                target=self._watch, args=(reload_interval,), daemon=True
+            )
+            self._watcher.start()
+
+    def __len__(self):
+        return len(self._snapshot.index)
+
+    def reload(self):
+        """Load the names if the file has changed, return True if loaded"""
+
+        stat = os.stat(self.filename)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp == self._stamp:
+            return False
+
+        with open(self.filename, "r") as infile:
+            names = set(x for x in (y.rstrip().lower() for y in infile) if x)
+
+        exact = dict()
+        for name in names:
+            for part in set([name] + name.split(".")):
+                exact.setdefault(part, []).append(name)
+        self._snapshot = Snapshot(NgramIndex(names), exact, sorted(exact.keys()))
+        self._stamp = stamp
+        return True
+
+    def find(self, text, limit=LIMIT):
+        """Return the best matches of a text, the number of matches in the
+        best class, and the total number of matches.
+
+        Parameters
+        ---------
+        text : str
+            The text to search
+
+        limit : int
+            The maximum number of matches returned
+        """
+
+        snapshot = self._snapshot
+        text = text.lower()
+
+        exact = set(snapshot.exact.get(text, []))
+
+        lo = bisect.bisect_left(snapshot.prefixes, text)
+        hi = bisect.bisect_left(snapshot.prefixes, text + chr(0x10FFFF), lo)
+        prefix = set()
+        for part in snapshot.prefixes[lo:hi]:
+            prefix.update(snapshot.exact[part])
+        prefix -= exact
+
+        total = snapshot.index.count(text)
+        best = len(exact) or len(prefix) or total
+
+        matches = heapq.nsmallest(limit, exact, key=rank)
+        matches += heapq.nsmallest(limit - len(matches), prefix, key=rank)
+        if len(matches) < limit:
+            skip = len(matches)
+            matches += [
+                x
+                for x in snapshot.index.find(text, limit + skip)
+                if x not in exact and x not in prefix
+            ]
+        return matches[:limit], best, total
+
+    def close(self):
+        """Stop checking the file"""
+
+        if self._watcher is not None:
+            self._stopped.set()
+            self._watcher.join()
+            self._watcher = None
+
+    def _watch(self, interval):
+        """Reload the names when the file changes until closed"""
+
+        while not self._stopped.wait(interval):
+            try:
+                if self.reload():
+                    print(
+                        f"Loaded {len(self)} names from {self.filename}",
+                        file=sys.stderr,
+                    )
+            except OSError as err:
+                print(f"Could not reload {self.filename}: {err}", file=sys.stderr)
+
+
+directory = None
 
 def toFullName(text: str):
     ret = ""
@@ -86,15 +182,12 @@ def getcce(text: str):
         error = True
 
     else:
-        candidates = list()
-        for candidate in names:
-            if tokens[0].lower() in candidate:
-                candidates.append(candidate)
+        candidates, best, total = directory.find(tokens[0])
 
         if len(candidates) == 0:
             response = f"Could not find an IIT member matching: {tokens[0]}"
 
-        elif len(candidates) == 1:
+        elif best == 1:
             response = (
                 f"{toFullName(candidates[0])} :point_down: "
                 f"![](https://www.iit.cnr.it/wp-content/themes/cnr/foto_personali_400/{candidates[0]}.jpg)"
@@ -102,8 +195,10 @@ def getcce(text: str):
             private = False
 
         else:
-            assert len(candidates) > 1
+            assert best > 1
             response = f"Too many matching names:\n" + "\n".join(candidates)
+            if total > len(candidates):
+                response += f"\n... and {total - len(candidates)} more"
 
     # Return the error / correct response
 
@@ -124,10 +219,12 @@ def getcce(text: str):
     return [response, private]
 
 
-def loadNames(filename: str):
-    with open(filename, "r") as infile:
-        for line in infile:
-            names.add(line.rstrip().lower())
+def slash_command(token, names="", reload_interval=1.0):
+    """Return the /cce slash command, with the names loaded from the given file"""
+
+    global directory
+    directory = NameDirectory(names, reload_interval)
+    return slashserver.SlashCommand("/cce", token, getcce, close=directory.close)
 
 
 if __name__ == "__main__":
@@ -144,11 +241,18 @@ if __name__ == "__main__":
         default="",
         help="Name of the file containing name and surnames.",
     )
+    parser.add_argument(
+        "--reload_interval",
+        type=float,
+        default=1.0,
+        help="How often, in seconds, to reload the names if changed, 0 to never.",
+    )
+    slashserver.add_arguments(parser)
     args = parser.parse_args()
 
-    token = args.token
-    loadNames(args.names)
-
-    with HTTPServer((args.host, args.port), PostHandler) as server:
-        print(f"Starting HTTP server at {args.host}:{args.port}, use <Ctrl-C> to stop")
-        server.serve_forever()
+    slashserver.serve(
+        args.host,
+        args.port,
+        lambda: [slash_command(args.token, args.names, args.reload_interval)],
+        **slashserver.options(args),
+    )
@@ -13,19 +13,12 @@ Mattermost documentation:
     http://docs.mattermost.com/developer/slash-commands.html
 """
 
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from urllib.parse import parse_qs
-import json
 import argparse
 import random
 import re
 
-from mattermostrequest import MattermostRequest
+import slashserver
 
-token = None
-
-# guarantee unicode string
-_u = lambda t: t.decode("UTF-8", "replace") if isinstance(t, str) else t
 
 DIGITS = {
     "0": ":zero:",
@@ -41,40 +34,6 @@ DIGITS = {
 }
 
 
-class PostHandler(BaseHTTPRequestHandler):
-    def do_POST(self):
-        """Respond to a POST request."""
-
-        # Extract the contents of the POST
-        length = int(self.headers["Content-Length"])
-        post_data = parse_qs(self.rfile.read(length).decode("utf-8"))
-
-        # Get POST data and initialize MattermostRequest object
-        request = MattermostRequest(post_data)
-
-        data = {}
-
-        if request.command[0] != "/cerino" or request.token[0] != token:
-            data["text"] = "invalid request"
-            self.send_response(401)
-            self.wfile.write(json.dumps(data).encode("utf-8"))
-            return
-
-        if not request.text:
-            responsetext = cerino("help")
-        else:
-            assert len(request.text) == 1
-            responsetext = cerino(request.text[0])
-
-        # Send response HTTP 200 (OK) to MM server
-        data["response_type"] = "ephemeral" if responsetext[1] else "in_channel"
-        data["text"] = responsetext[0]
-        self.send_response(200)
-        self.send_header("Content-type", "application/json")
-        self.end_headers()
-        self.wfile.write(json.dumps(data).encode("utf-8"))
-
-
 def digitToEmoji(num: int) -> str:
     ret = ""
     for digit in str(num):
@@ -164,6 +123,12 @@ def cerino(text):
     return [response, False]
 
 
+def slash_command(token):
+    """Return the /cerino slash command"""
+
+    return slashserver.SlashCommand("/cerino", token, cerino)
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         "Mattermost handle slash command to return a random element from a set",
@@ -172,10 +137,12 @@ if __name__ == "__main__":
     parser.add_argument("--host", type=str, default="localhost", help="Host to bind.")
     parser.add_argument("--port", type=int, default=10000, help="Host to bind.")
     parser.add_argument("--token", type=str, default="", help="Token to match.")
+    slashserver.add_arguments(parser)
     args = parser.parse_args()
 
-    token = args.token
-
-    with HTTPServer((args.host, args.port), PostHandler) as server:
-        print(f"Starting HTTP server at {args.host}:{args.port}, use <Ctrl-C> to stop")
-        server.serve_forever()
+    slashserver.serve(
+        args.host,
+        args.port,
+        lambda: [slash_command(args.token)],
+        **slashserver.options(args),
+    )
@@ -0,0 +1,119 @@
+"""
+Deferred responses to Mattermost slash commands.
+
+Mattermost gives up waiting for the response to a slash command after a
+timeout. A command that may take longer can instead reply immediately with
+an acknowledgement and compute the actual response in background: the
+latter is then sent by POSTing it to the response_url of the request.
+
+The responses are computed in a bounded pool of worker threads, fed by a
+bounded queue of pending requests.
+"""
+
+import json
+import queue
+import sys
+import urllib.request
+from threading import Thread
+
+from slashserver import response_data
+
+DEFAULT_WORKERS = 4
+DEFAULT_DEPTH = 100
+DEFAULT_TIMEOUT = 10.0
+
+
+class DeferredResponder(object):
+    def __init__(
+        self, workers=DEFAULT_WORKERS, depth=DEFAULT_DEPTH, timeout=DEFAULT_TIMEOUT
+    ):
+        """Start the worker threads.
+
+        Parameters
+        ---------
+        workers : int
+            The number of responses computed concurrently
+
+        depth : int
+            The maximum number of requests waiting for a worker
+
+        timeout : float
+            The timeout, in seconds, to POST a response to Mattermost
+        """
+
+        assert workers > 0
+        self._timeout = timeout
+        self._queue = queue.Queue(maxsize=depth)
+        self._workers = [
+            Thread(target=self._work, daemon=True) for _ in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, response_url, handler, *args):
+        """Queue the computation of a response.
+
+        Parameters
+        ---------
+        response_url : str
+            The URL where to POST the response
+
+        handler : callable
+            Function called with args, which returns the response to be sent
+            and whether it should be private
+
+        Returns
+        -------
+        True if the request has been queued, False if the queue is full
+        """
+
+        try:
+            self._queue.put_nowait((response_url, handler, args))
+            return True
+        except queue.Full:
+            return False
+
+    def pending(self):
+        """Return the number of requests waiting for a worker"""
+
+        return self._queue.qsize()
+
+    def close(self):
+        """Wait for the requests queued to be served, then stop the workers"""
+
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
+    def _work(self):
+        """Serve the requests in the queue until a None is found"""
+
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+
+            response_url, handler, args = item
+            try:
+                responsetext = handler(*args)
+            except Exception as err:
+                responsetext = [f"Error: {err}", True]
+
+            try:
+                post(response_url, response_data(responsetext), self._timeout)
+            except Exception as err:
+                print(f"Could not send response to {response_url}: {err}", file=sys.stderr)
+
+
+def post(url, data, timeout=DEFAULT_TIMEOUT):
+    """POST data as JSON to a URL"""
+
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(data).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        response.read()
@@ -1,29 +1,115 @@
 #!/usr/bin/env python3
+"""
+Retrieve the EID of authors from Scopus, by first and last name.
+
+In batch mode the names are read from a semicolon-separated file, with the
+last and first names in the first two fields, e.g.:
+
+./eid.py --batch names --output results.jsonl
+
+The results are appended to the output file, one JSON object per line, as
+soon as they are retrieved. If the crawl is interrupted, running it again
+with the same output file only retrieves the names not yet done. The rate
+of the queries adapts to that accepted by Scopus.
+"""
 
 import argparse
+import json
+import sys
 
-import pandas as pd
-from pybliometrics.scopus import AuthorRetrieval, AuthorSearch
+from hindex import (
+    DEFAULT_CACHE_TTL,
+    DEFAULT_SCOPUS_TIMEOUT,
+    FakeScopusClient,
+    configure_cache,
+    configure_scopus,
+    get_cache,
+    search_authors,
+)
+from ratelimit import DEFAULT_BACKOFF, DEFAULT_RETRIES
 
 
 class ScopusEid(object):
     def get_by_name(self, first, last):
         """Return a table of EID, affiliation, town, country otherwise."""
 
-        au = AuthorSearch("AUTHLAST({}) and AUTHFIRST({})".format(last, first))
+        authors = search_authors(first, last)
 
-        if au.get_results_size() == 0:
+        if len(authors) == 0:
             return None
 
-        df = pd.DataFrame(au.authors)
         ret = []
-        for x in zip(df["eid"], df["affiliation"], df["city"], df["country"]):
+        for x in authors:
             tokens = x[0].split("-")
             ret.append([tokens[-1], x[1], x[2], x[3]])
 
         return ret
 
 
+def read_names(filename):
+    """Return the list of distinct (last, first) names in a semicolon-separated file"""
+
+    names = []
+    seen = set()
+    with open(filename, "r") as infile:
+        for line in infile:
+            tokens = line.rstrip().split(";")
+            if len(tokens) >= 2 and tokens[0] and tokens[1]:
+                name = (tokens[0], tokens[1])
+                if name not in seen:
+                    seen.add(name)
+                    names.append(name)
+    return names
+
+
+def load_done(filename):
+    """Return the set of (last, first) names in a results file, if existing.
+
+    An incomplete last line, e.g., because of a crash while writing it, is
+    removed from the file.
+    """
+
+    done = set()
+    try:
+        with open(filename, "rb+") as results:
+            good = 0
+            for line in results:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                done.add((record["last"], record["first"]))
+                good += len(line)
+            results.truncate(good)
+    except FileNotFoundError:
+        pass
+    return done
+
+
+def crawl(names, output):
+    """Retrieve the EID of the authors in the file names not yet in output"""
+
+    scopus_eid = ScopusEid()
+    todo = read_names(names)
+    done = load_done(output)
+    total = len(todo)
+    todo = [x for x in todo if x not in done]
+
+    with open(output, "a") as results:
+        for i, (last, first) in enumerate(todo):
+            authors = scopus_eid.get_by_name(first, last) or []
+            record = {"last": last, "first": first, "authors": authors}
+            results.write(json.dumps(record) + "\n")
+            results.flush()
+            print(
+                f"{total - len(todo) + i + 1}/{total}: {first} {last}, "
+                f"{len(authors)} found",
+                file=sys.stderr,
+            )
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser("Retrieve EID of an author from Scopus")
     parser.add_argument(
@@ -32,22 +118,93 @@ if __name__ == "__main__":
     parser.add_argument(
         "--lastname", type=str, default="", help="Last name of the author"
     )
+    parser.add_argument(
+        "--cache",
+        type=str,
+        default="",
+        help="File where to cache the results of Scopus queries",
+    )
+    parser.add_argument(
+        "--cache_ttl",
+        type=float,
+        default=DEFAULT_CACHE_TTL,
+        help="Time, in seconds, after which cached results expire",
+    )
+    parser.add_argument(
+        "--batch",
+        type=str,
+        default="",
+        help="File with the names of the authors, one per line",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default="results.jsonl",
+        help="File where to save the results in batch mode",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=0.5,
+        help="Initial number of queries per second in batch mode",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=DEFAULT_RETRIES,
+        help="Number of times a query is retried if throttled",
+    )
+    parser.add_argument(
+        "--backoff",
+        type=float,
+        default=DEFAULT_BACKOFF,
+        help="Time, in seconds, to wait before retrying a throttled query",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=DEFAULT_SCOPUS_TIMEOUT,
+        help="Time, in seconds, after which a stalled query fails",
+    )
+    parser.add_argument(
+        "--fake", action="store_true", help="Use random results instead of Scopus"
+    )
     args = parser.parse_args()
 
+    configure_cache(args.cache, args.cache_ttl)
+    configure_scopus(
+        FakeScopusClient() if args.fake else None,
+        args.rate if args.batch else 0.0,
+        1,
+        args.retries,
+        args.backoff,
+        adaptive=True,
+        timeout=args.timeout,
+    )
+
     try:
-        scopus_eid = ScopusEid()
+        if args.batch:
+            crawl(args.batch, args.output)
+
+        else:
+            scopus_eid = ScopusEid()
 
-        value = scopus_eid.get_by_name(args.firstname, args.lastname)
+            value = scopus_eid.get_by_name(args.firstname, args.lastname)
 
-        if not value:
-            raise Exception(
-                "No author found with first name '{}' and last name '{}'".format(
-                    firstname, lastname
+            if not value:
+                raise Exception(
+                    "No author found with first name '{}' and last name '{}'".format(
+                        firstname, lastname
+                    )
                 )
-            )
 
-        for x in value:
-            print(f"{x[0]} {x[1]} {x[2]} {x[3]}")
+            for x in value:
+                print(f"{x[0]} {x[1]} {x[2]} {x[3]}")
+
+    except KeyboardInterrupt:
+        print("Interrupted", file=sys.stderr)
 
     except Exception as err:
         print(f"Error: {err}")
+
+    get_cache().close()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Mattermost server in tests.
+
+It receives the deferred responses POSTed by the bots to the response_url
+of the requests, and it prints them on the standard output. It can also
+send a slash command request to a bot, with response_url pointing to
+itself, and wait for the deferred response.
+
+Example, with hindexslash.py listening on port 10000 with token TOKEN:
+
+./fakemattermost.py --port 10100 --bot http://localhost:10000/ \
+                    --command /hindex --token TOKEN --text "get 22988279600"
+"""
+
+import argparse
+import json
+import queue
+import threading
+import urllib.parse
+import urllib.request
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+
+class ResponseHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        """Save the response received."""
+
+        length = int(self.headers["Content-Length"])
+        data = json.loads(self.rfile.read(length).decode("utf-8"))
+        self.server.responses.put((self.path, data))
+
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeMattermost(object):
+    """Mattermost stand-in receiving the deferred responses"""
+
+    def __init__(self, host="localhost", port=0):
+        """Start listening, on a random free port if port is 0"""
+
+        self._server = HTTPServer((host, port), ResponseHandler)
+        self._server.responses = queue.Queue()
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def response_url(self, path="/response"):
+        """Return the response_url to be sent to the bots"""
+
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}{path}"
+
+    def command(self, bot_url, command, token, text, **fields):
+        """Send a slash command to a bot, return its immediate response"""
+
+        body = dict(
+            command=command,
+            token=token,
+            text=text,
+            response_url=self.response_url(),
+            **fields,
+        )
+        with urllib.request.urlopen(
+            bot_url, data=urllib.parse.urlencode(body).encode("utf-8")
+        ) as response:
+            return json.loads(response.read().decode("utf-8"))
+
+    def wait_response(self, timeout=None):
+        """Return the path and data of the next deferred response received,
+        raise queue.Empty if none is received within the timeout"""
+
+        return self._server.responses.get(timeout=timeout)
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        "Mattermost stand-in receiving the deferred responses of the bots",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--host", type=str, default="localhost", help="Host to bind.")
+    parser.add_argument("--port", type=int, default=10100, help="Port to bind.")
+    parser.add_argument(
+        "--bot", type=str, default="", help="URL of the bot, if a command is to be sent."
+    )
+    parser.add_argument("--command", type=str, default="", help="Command to send.")
+    parser.add_argument("--token", type=str, default="", help="Token of the command.")
+    parser.add_argument("--text", type=str, default="", help="Text of the command.")
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=60.0,
+        help="Time to wait for the deferred response, in seconds.",
+    )
+    args = parser.parse_args()
+
+    mattermost = FakeMattermost(args.host, args.port)
+    print(f"Receiving responses at {mattermost.response_url()}, use <Ctrl-C> to stop")
+
+    try:
+        if args.bot:
+            print(mattermost.command(args.bot, args.command, args.token, args.text))
+            print(mattermost.wait_response(args.timeout))
+
+        else:
+            while True:
+                print(mattermost.wait_response())
+
+    except KeyboardInterrupt:
+        pass
+
+    except queue.Empty:
+        print("Error: no deferred response received")
+
+    mattermost.close()
@@ -4,6 +4,11 @@ Read a names from a semicolor-separated list in a file and queries
 Elsevier Scopus via HTTP APIs to retrieve and plot (in an ASCII-art table)
 the result.
 
+The authors are searched in batches by EID, which takes far fewer queries
+than searching them one by one, and retrieved concurrently by multiple
+workers, while not exceeding a given rate of queries to Scopus. The
+progress is shown on stderr.
+
 Example:
 
 1. create the input file, e.g.:
@@ -20,11 +25,17 @@ Einstein A. (Genius)  ▇▇▇▇▇▇▇▇▇▇▇▇▇▇▇▇▇▇▇
 """
 
 import argparse
-import random
+import sys
 from operator import itemgetter
 
-import pandas as pd
-from pybliometrics.scopus import AuthorRetrieval, AuthorSearch
+from hindex import DEFAULT_SCOPUS_TIMEOUT, FakeScopusClient, Hindex, configure_scopus
+from ratelimit import DEFAULT_BACKOFF, DEFAULT_RETRIES
+
+
+def show_progress(done, total):
+    """Print on stderr the number of h-index values retrieved so far"""
+
+    print(f"\rRetrieved {done}/{total}", end="", file=sys.stderr, flush=True)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
@@ -33,9 +44,63 @@ if __name__ == "__main__":
     parser.add_argument(
         "--input", type=str, default="names", help="The input file name"
     )
-    parser.add_argument("--fake", action="store_true", help="Use random numbers")
+    parser.add_argument(
+        "--workers", type=int, default=4, help="Number of concurrent queries"
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=2.0,
+        help="Maximum number of queries per second, 0 for no limit",
+    )
+    parser.add_argument(
+        "--burst", type=int, default=2, help="Maximum number of queries in a burst"
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=DEFAULT_RETRIES,
+        help="Number of times a query is retried if throttled",
+    )
+    parser.add_argument(
+        "--backoff",
+        type=float,
+        default=DEFAULT_BACKOFF,
+        help="Time, in seconds, to wait before retrying a throttled query",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=DEFAULT_SCOPUS_TIMEOUT,
+        help="Time, in seconds, after which a stalled query fails",
+    )
+    parser.add_argument(
+        "--fake", action="store_true", help="Use random numbers instead of Scopus"
+    )
+    parser.add_argument(
+        "--fake_latency",
+        type=float,
+        default=0.5,
+        help="Average latency, in seconds, of the queries in fake mode",
+    )
+    parser.add_argument(
+        "--fake_throttle",
+        type=float,
+        default=0.0,
+        help="Probability that a query is throttled in fake mode",
+    )
     args = parser.parse_args()
 
+    configure_scopus(
+        FakeScopusClient(args.fake_latency, args.fake_throttle) if args.fake else None,
+        args.rate,
+        args.burst,
+        args.retries,
+        args.backoff,
+        pool_size=args.workers,
+        timeout=args.timeout,
+    )
+
     try:
         names = []
         largest_name = 0
@@ -48,20 +113,19 @@ if __name__ == "__main__":
                     for firstname in tokens[1].split(" "):
                         initials.append(firstname[0] + ".")
 
-                    hindex = 0
-                    if args.fake:
-                        hindex = int(random.expovariate(1 / 20.0))
-                    else:
-                        au = AuthorSearch(f"AU-ID({tokens[3]})")
-                        if au.get_results_size() > 0:
-                            assert au.get_results_size() == 1
-                            hindex = int(AuthorRetrieval(au.authors[0][0]).h_index)
-
                     fullname = tokens[0] + " " + " ".join(initials)
                     largest_name = max(largest_name, len(fullname))
                     largest_title = max(largest_title, len(tokens[2]))
 
-                    names.append([fullname, tokens[2], hindex])
+                    names.append([fullname, tokens[2], tokens[3]])
+
+        hindices = Hindex().get_by_eids(
+            [x[2] for x in names], workers=args.workers, progress=show_progress
+        )
+        print(file=sys.stderr)
+
+        for name in names:
+            name[2] = int(hindices[name[2]]) if hindices[name[2]] else 0
 
         for name in sorted(names, key=itemgetter(2), reverse=True):
             print(
@@ -1,41 +1,628 @@
 #!/usr/bin/env python3
 
 import argparse
+import configparser
+import os
+import random
+import re
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
 
-import pandas as pd
-from pybliometrics.scopus import AuthorRetrieval, AuthorSearch
+import metrics
+from persdicstorage import SqliteStorage
+from ratelimit import (DEFAULT_BACKOFF, DEFAULT_RETRIES, AdaptiveTokenBucket,
+                       TokenBucket, retry)
+
+DEFAULT_CACHE_TTL = 7 * 24 * 3600
+DEFAULT_CACHE_CAPACITY = 1000
+AU_ID_CHUNK = 25
+
+SCOPUS_URL = 'https://api.elsevier.com/content'
+# configuration file of pybliometrics, used before, with the API key
+PYBLIOMETRICS_CONFIG = os.path.join('~', '.scopus', 'config.ini')
+DEFAULT_SCOPUS_POOL = 8
+DEFAULT_SCOPUS_TIMEOUT = 10.0
+# retries of the queries failing because of the connection or the server
+HTTP_RETRIES = 3
+HTTP_BACKOFF = 0.5
+RETRY_STATUS = (500, 502, 503, 504)
+# maximum number of authors returned by a search query
+SEARCH_COUNT = 200
+# maximum number of authors found by a search, as pybliometrics, beyond
+# which Scopus does not return them anyway
+MAX_ENTRIES = 5000
+
+# returned by ScopusCache.get() when a result is not cached
+MISSING = object()
+
+SCOPUS_SECONDS = metrics.histogram(
+    'mmbots_scopus_request_seconds', 'Time to query Scopus, per attempt.',
+    ('method',))
+SCOPUS_ERRORS = metrics.counter(
+    'mmbots_scopus_errors_total', 'Failed Scopus queries, per attempt.',
+    ('method', 'error'))
+CACHE_LOOKUPS = metrics.counter(
+    'mmbots_scopus_cache_total', 'Lookups of Scopus results in the cache.',
+    ('result',))
+
+class ScopusCache(object):
+    """Cache of the results of Scopus queries, which expire after a TTL.
+
+    The most recently used results are kept in memory, up to a given
+    capacity, and all of them are optionally saved in an SQLite database,
+    from which the others are read, through its index, when needed. The
+    database can be used by multiple processes at the same time. Expired
+    results are removed from it when opened, or replaced when found again.
+    """
+
+    def __init__(self, filename=None, ttl=DEFAULT_CACHE_TTL,
+                 capacity=DEFAULT_CACHE_CAPACITY):
+        """Initialize the cache.
+
+        Parameters
+        ----------
+        filename : str
+            The name of the SQLite database where to save the results,
+            None to only keep them in memory
+
+        ttl : float
+            The time, in seconds, after which a result expires
+
+        capacity : int
+            The maximum number of results kept in memory
+        """
+
+        self.ttl = ttl
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = Lock()
+        self._disk = None
+        if filename:
+            self._disk = SqliteStorage(filename)
+            self._expire()
+
+    def lookup(self, key, query):
+        """Return the result of a query from the cache, if not expired,
+        otherwise execute the query and save its result.
+
+        Parameters
+        ----------
+        key : str
+            The key identifying the query
+
+        query : callable
+            Function returning the result of the query, which must be
+            serializable as JSON
+        """
+
+        result = self.get(key)
+        if result is not MISSING:
+            return result
+
+        result = query()
+        self.put(key, result)
+        return result
+
+    def get(self, key):
+        """Return the result of a query from the cache, or MISSING if not
+        cached or expired"""
+
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+
+        if entry is None and self._disk is not None:
+            entry = self._disk.get(key)
+
+        if entry is not None and now - entry[0] < self.ttl:
+            with self._lock:
+                self.hits += 1
+                self._remember(key, entry)
+            CACHE_LOOKUPS.inc('hit')
+            return entry[1]
+
+        CACHE_LOOKUPS.inc('miss')
+        return MISSING
+
+    def put(self, key, result):
+        """Save the result of a query, which was not found in the cache"""
+
+        entry = [time.time(), result]
+        with self._lock:
+            self.misses += 1
+            self._remember(key, entry)
+        if self._disk is not None:
+            self._disk.write([['add', key, entry]])
+
+    def stats(self):
+        """Return the number of hits, misses, and results in memory"""
+
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses,
+                        entries=len(self._memory))
+
+    def close(self):
+        """Close the database, if any"""
+
+        if self._disk is not None:
+            self._disk.close()
+
+    def _expire(self):
+        """Remove the expired results from the database"""
+
+        now = time.time()
+        expired = [['del', key] for key, entry in self._disk.items()
+                   if now - entry[0] >= self.ttl]
+        if expired:
+            self._disk.write(expired)
+
+    def _remember(self, key, entry):
+        """Keep a result in memory, evicting the least recently used"""
+
+        assert self._lock.locked()
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.capacity:
+            self._memory.popitem(last=False)
+
+_cache = ScopusCache()
+
+def configure_cache(filename=None, ttl=DEFAULT_CACHE_TTL,
+                    capacity=DEFAULT_CACHE_CAPACITY):
+    """Replace the cache shared by all the Scopus queries"""
+
+    global _cache
+    _cache.close()
+    _cache = ScopusCache(filename, ttl, capacity)
+    return _cache
+
+def get_cache():
+    """Return the cache shared by all the Scopus queries"""
+
+    return _cache
+
+class ScopusThrottled(Exception):
+    """Raised when a query is rejected because of the Scopus quotas"""
+
+class ScopusQueryError(Exception):
+    """Raised when a search finds too many authors"""
+
+def scopus_credentials():
+    """Return the Scopus API key and the institutional token, if any, from
+    the environment variables SCOPUS_API_KEY and SCOPUS_INST_TOKEN or, if
+    not set, from the configuration file of pybliometrics"""
+
+    api_key = os.environ.get('SCOPUS_API_KEY', '')
+    inst_token = os.environ.get('SCOPUS_INST_TOKEN', '')
+    if not api_key:
+        config = configparser.ConfigParser()
+        config.read(os.path.expanduser(PYBLIOMETRICS_CONFIG))
+        api_key = config.get('Authentication', 'APIKey', fallback='')
+        api_key = api_key.split(',')[0].strip()
+        inst_token = config.get('Authentication', 'InstToken', fallback='')
+    return api_key, inst_token.strip()
+
+Author = namedtuple('Author', 'eid affiliation city country')
+
+class ScopusClient(object):
+    """Queries to the Scopus APIs, done by all the threads on the same pool
+    of persistent connections.
+
+    requests is only imported, and the connections opened, when the first
+    query is done, to keep the startup fast. Queries failing because of the
+    connection or a server error (5xx) are retried with backoff, while those
+    throttled (429) raise ScopusThrottled, to be retried by _query(), which
+    notifies the rate limiter. Searches finding too many authors raise
+    ScopusQueryError after the first page, without fetching the others.
+    """
+
+    def __init__(self, pool_size=DEFAULT_SCOPUS_POOL,
+                 timeout=DEFAULT_SCOPUS_TIMEOUT, url=SCOPUS_URL, api_key=None,
+                 inst_token=None, max_entries=MAX_ENTRIES):
+        """Initialize the client.
+
+        Parameters
+        ----------
+        pool_size : int
+            The maximum number of connections open, which is also the
+            maximum number of queries done concurrently
+
+        timeout : float
+            The time, in seconds, after which a query fails if connecting
+            or receiving data from Scopus stalls
+
+        url : str
+            The base URL of the Scopus APIs, e.g., that of a local server
+            simulating them
+
+        api_key : str
+            The Scopus API key, None to use scopus_credentials()
+
+        inst_token : str
+            The institutional token, if any, when api_key is not None
+
+        max_entries : int
+            The maximum number of authors found by a search
+        """
+
+        if pool_size < 1:
+            raise ValueError(f'Invalid pool size: {pool_size}')
+
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.url = url.rstrip('/')
+        self.max_entries = max_entries
+        self._credentials = None if api_key is None else (api_key,
+                                                          inst_token or '')
+        self._session = None
+        self._lock = Lock()
+
+    def search(self, query):
+        """Return the list of authors found by a query"""
+
+        authors = []
+        while True:
+            results = self._get('search/author', query=query,
+                                start=len(authors),
+                                count=SEARCH_COUNT)['search-results']
+            total = int(results.get('opensearch:totalResults') or 0)
+            if total > self.max_entries:
+                raise ScopusQueryError(
+                    f'Found {total} authors, more than {self.max_entries}')
+            # an empty result set has an entry with the error
+            entries = results.get('entry', []) if total > 0 else []
+            for entry in entries:
+                affiliation = entry.get('affiliation-current') or {}
+                if isinstance(affiliation, list):
+                    affiliation = affiliation[0]
+                authors.append(Author(
+                    entry['eid'], affiliation.get('affiliation-name'),
+                    affiliation.get('affiliation-city'),
+                    affiliation.get('affiliation-country')))
+            if not entries or len(authors) >= total:
+                return authors
+
+    def h_index(self, au_id):
+        """Return the h-index of an author"""
+
+        author = self._get(f'author/author_id/{au_id}',
+                           view='METRICS')['author-retrieval-response']
+        if isinstance(author, list):
+            author = author[0]
+        return author.get('h-index')
+
+    def close(self):
+        """Close the connections"""
+
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def _get(self, path, **params):
+        """Return the JSON response to a GET of an API"""
+
+        response = self._open().get(f'{self.url}/{path}', params=params,
+                                    timeout=self.timeout)
+        if response.status_code == 429:
+            raise ScopusThrottled(
+                f'Quota exceeded: {response.headers.get("X-ELS-Status", "")}')
+        response.raise_for_status()
+        return response.json()
+
+    def _open(self):
+        """Return the session, created upon the first query"""
+
+        with self._lock:
+            if self._session is not None:
+                return self._session
+
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+
+            api_key, inst_token = self._credentials or scopus_credentials()
+            if not api_key:
+                raise RuntimeError(
+                    'No Scopus API key, set SCOPUS_API_KEY or configure '
+                    f'pybliometrics in {PYBLIOMETRICS_CONFIG}')
+
+            session = requests.Session()
+            session.headers.update({
+                'Accept': 'application/json',
+                'X-ELS-APIKey': api_key,
+            })
+            if inst_token:
+                session.headers['X-ELS-Insttoken'] = inst_token
+
+            # the queries in excess of the pool wait for a connection,
+            # rather than opening one that would be closed right after
+            adapter = HTTPAdapter(
+                pool_connections=1, pool_maxsize=self.pool_size,
+                pool_block=True,
+                max_retries=Retry(total=HTTP_RETRIES,
+                                  backoff_factor=HTTP_BACKOFF,
+                                  status_forcelist=RETRY_STATUS,
+                                  raise_on_status=False,
+                                  # or a 429 with Retry-After would be
+                                  # retried here, hidden from the limiter
+                                  respect_retry_after_header=False))
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            self._session = session
+            return session
+
+class FakeScopusClient(object):
+    """Simulated Scopus, which returns random results after some latency"""
+
+    def __init__(self, latency=0.5, throttle=0.0, seed=None):
+        """Initialize the client.
+
+        Parameters
+        ----------
+        latency : float
+            The average time, in seconds, to answer a query
+
+        throttle : float
+            The probability that a query is rejected by throttling
+
+        seed : int
+            The seed of the random number generator
+        """
+
+        self.latency = latency
+        self.throttle = throttle
+        self._rng = random.Random(seed)
+        self._lock = Lock()
+
+    def search(self, query):
+        """Return one author per AU-ID in the query, or one for a name"""
+
+        self._wait()
+        au_ids = re.findall(r'AU-ID\((\d+)\)', query)
+        if not au_ids:
+            with self._lock:
+                au_ids = [str(self._rng.randint(10 ** 9, 10 ** 10))]
+        return [Author(f'9-s2.0-{x}', 'Fake University', 'Pisa', 'Italy')
+                for x in au_ids]
+
+    def h_index(self, au_id):
+        """Return a random h-index"""
+
+        self._wait()
+        with self._lock:
+            return int(self._rng.expovariate(1 / 20.0))
+
+    def close(self):
+        """Nothing to close"""
+
+        pass
+
+    def _wait(self):
+        """Wait for a random latency, then raise ScopusThrottled if throttled"""
+
+        with self._lock:
+            latency = self._rng.uniform(0.5, 1.5) * self.latency
+            throttled = self._rng.random() < self.throttle
+        time.sleep(latency)
+        if throttled:
+            raise ScopusThrottled('Simulated quota exceeded')
+
+_client = ScopusClient()
+_limiter = None
+_retries = DEFAULT_RETRIES
+_backoff = DEFAULT_BACKOFF
+
+def configure_scopus(client=None, rate=0.0, burst=1, retries=DEFAULT_RETRIES,
+                     backoff=DEFAULT_BACKOFF, adaptive=False,
+                     pool_size=DEFAULT_SCOPUS_POOL,
+                     timeout=DEFAULT_SCOPUS_TIMEOUT):
+    """Set how all the Scopus queries are done.
+
+    Parameters
+    ----------
+    client : object
+        The client executing the queries, e.g., a FakeScopusClient, None
+        to use a ScopusClient with the given pool size and timeout
+
+    rate : float
+        If positive, the maximum number of queries per second, on average
+
+    burst : int
+        The maximum number of queries in a burst, if rate is positive
+
+    retries : int
+        The number of times a query is retried if throttled
+
+    backoff : float
+        The time, in seconds, to wait before retrying a throttled query the
+        first time, doubled at every further attempt
+
+    adaptive : bool
+        If true then rate is only the initial rate, which is then adapted
+        to that accepted by Scopus
+
+    pool_size : int
+        The maximum number of connections open to Scopus
+
+    timeout : float
+        The time, in seconds, after which a query fails if stalled
+    """
+
+    global _client, _limiter, _retries, _backoff
+    _client.close()
+    _client = (client if client is not None
+               else ScopusClient(pool_size, timeout))
+    _limiter = None
+    if rate > 0:
+        _limiter = (AdaptiveTokenBucket if adaptive else TokenBucket)(rate, burst)
+    _retries = retries
+    _backoff = backoff
+
+def close_scopus():
+    """Close the connections to Scopus, which are opened again if needed"""
+
+    _client.close()
+
+def _query(method, *args):
+    """Return the result of a query, rate limited and retried if throttled.
+
+    The latency and the errors of every attempt are recorded in the metrics,
+    without the time waiting for the rate limiter or before retrying.
+    """
+
+    name = method.__name__
+
+    def attempt():
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        except Exception as err:
+            SCOPUS_ERRORS.inc(name, type(err).__name__)
+            raise
+        finally:
+            SCOPUS_SECONDS.observe(time.perf_counter() - start, name)
+
+    return retry(attempt, (ScopusThrottled,), _retries, _backoff, _limiter)
+
+def search_authors(first, last):
+    """Return the list of EID, affiliation, town, country of the authors
+    with given first and last name, cached by normalized name"""
+
+    def query():
+        authors = _query(_client.search,
+                         'AUTHLAST({}) and AUTHFIRST({})'.format(last, first))
+        return [[x.eid, x.affiliation, x.city, x.country] for x in authors]
+
+    key = 'name:{}|{}'.format(' '.join(first.lower().split()),
+                              ' '.join(last.lower().split()))
+    return _cache.lookup(key, query)
+
+def get_h_index(eid, found=False):
+    """Return the h-index of an author by EID if found, None otherwise,
+    cached by EID.
+
+    If found is true then the EID has been already returned by a search,
+    hence the author is retrieved without searching for it first.
+    """
+
+    au_id = eid.split('-')[-1]
+
+    def query():
+        if not found:
+            authors = _query(_client.search, 'AU-ID({})'.format(au_id))
+            if len(authors) == 0:
+                return None
+            assert len(authors) == 1
+
+        return _query(_client.h_index, au_id)
+
+    return _cache.lookup(f'eid:{au_id}', query)
+
+def get_h_indices(eids, chunk=AU_ID_CHUNK, workers=1, progress=None):
+    """Return a dict with the h-index of the authors by EID, None if not found.
+
+    The EIDs not cached are searched with one query for every chunk of
+    them, then the authors found are retrieved one by one, because the
+    h-index is not part of the search results.
+
+    Parameters
+    ----------
+    eids : list
+        The EIDs of the authors
+
+    chunk : int
+        The maximum number of EIDs searched with one query
+
+    workers : int
+        The number of queries done concurrently
+
+    progress : callable
+        If not None, function called with the number of EIDs done and
+        the total number of (distinct) EIDs every time one is done
+    """
+
+    ret = dict()
+    total = len(set(eids))
+    missing = OrderedDict()
+    for eid in eids:
+        au_id = eid.split('-')[-1]
+        result = _cache.get(f'eid:{au_id}')
+        if result is MISSING:
+            missing.setdefault(au_id, []).append(eid)
+        else:
+            ret[eid] = result
+
+    lock = Lock()
+
+    def done(au_id, h_index):
+        with lock:
+            for eid in missing[au_id]:
+                ret[eid] = h_index
+            if progress is not None:
+                progress(len(ret), total)
+
+    def search(batch):
+        authors = _query(_client.search,
+                         ' OR '.join(f'AU-ID({x})' for x in batch))
+        found = set(x.eid.split('-')[-1] for x in authors)
+        for au_id in batch:
+            if au_id not in found:
+                _cache.put(f'eid:{au_id}', None)
+                done(au_id, None)
+        return [x for x in batch if x in found]
+
+    def retrieve(au_id):
+        done(au_id, get_h_index(au_id, found=True))
+
+    if progress is not None and len(ret) > 0:
+        progress(len(ret), total)
+
+    au_ids = list(missing.keys())
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        batches = [au_ids[i:i + chunk] for i in range(0, len(au_ids), chunk)]
+        found = [x for y in executor.map(search, batches) for x in y]
+        for _ in executor.map(retrieve, found):
+            pass
+
+    return ret
 
 class Hindex(object):
     def get_by_eid(self, eid):
         """Return the h-index of an author by a EID if found, None otherwise.
         """
 
-        au = AuthorSearch('AU-ID({})'.format(eid))
-        if au.get_results_size() == 0:
-            return None
+        return get_h_index(eid)
 
-        assert au.get_results_size() == 1
-        res = AuthorRetrieval(au.authors[0][0])
-        return res.h_index
+    def get_by_eids(self, eids, workers=1, progress=None):
+        """Return a dict with the h-index of the authors by EID, None for
+        those not found, using the given number of concurrent queries.
+        """
+
+        return get_h_indices(eids, workers=workers, progress=progress)
 
     def get_by_name(self, first, last):
         """Return the h-index of an author if there is only one matching, None if none is
         found, or a table with EID, affiliation, town, country otherwise.
         """
 
-        au = AuthorSearch('AUTHLAST({}) and AUTHFIRST({})'.format(last, first))
+        authors = search_authors(first, last)
 
-        if au.get_results_size() == 0:
+        if len(authors) == 0:
             return [ None, False ]
 
-        elif au.get_results_size() == 1:
-            res = AuthorRetrieval(au.authors[0][0])
-            return [ res.h_index, False ]
+        elif len(authors) == 1:
+            return [ get_h_index(authors[0][0], found=True), False ]
 
         else:
-            df = pd.DataFrame(au.authors)
             ret = []
-            for x in zip(df['eid'], df['affiliation'], df['city'], df['country']):
+            for x in authors:
                 tokens = x[0].split('-')
                 ret.append([tokens[-1], x[1], x[2], x[3]])
             return [ ret, True ]
@@ -48,8 +635,14 @@ if __name__ == '__main__':
                         help="Last name of the author")
     parser.add_argument("--eid", type=str, default="",
                         help="Author identifier")
+    parser.add_argument("--cache", type=str, default="",
+                        help="File where to cache the results of Scopus queries")
+    parser.add_argument("--cache_ttl", type=float, default=DEFAULT_CACHE_TTL,
+                        help="Time, in seconds, after which cached results expire")
     args = parser.parse_args()
 
+    configure_cache(args.cache, args.cache_ttl)
+
     try:
         if (not args.firstname or not args.lastname) and not args.eid:
             raise Exception("You must specify the first name and last name of the author, or the EID")
@@ -82,3 +675,5 @@ if __name__ == '__main__':
 
     except Exception as err:
         print(f'Error: {err}')
+
+    get_cache().close()
@@ -13,56 +13,58 @@ Mattermost documentation:
     http://docs.mattermost.com/developer/slash-commands.html
 """
 
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from urllib.parse import parse_qs
-import json
 import argparse
+import re
 
-from mattermostrequest import MattermostRequest
-from hindex import Hindex
+import slashserver
+from deferred import DEFAULT_DEPTH, DEFAULT_WORKERS, DeferredResponder
+from hindex import (
+    DEFAULT_CACHE_CAPACITY,
+    DEFAULT_CACHE_TTL,
+    DEFAULT_SCOPUS_POOL,
+    DEFAULT_SCOPUS_TIMEOUT,
+    FakeScopusClient,
+    Hindex,
+    ScopusQueryError,
+    close_scopus,
+    configure_cache,
+    configure_scopus,
+)
 
-token = None
+# maximum number of authors listed when a name matches more
+MAX_ROWS = 50
 
-# guarantee unicode string
-_u = lambda t: t.decode("UTF-8", "replace") if isinstance(t, str) else t
+deferred = None
 
 
-class PostHandler(BaseHTTPRequestHandler):
-    def do_POST(self):
-        """Respond to a POST request."""
+def is_eid(token):
+    """Return True if a token is an EID, i.e., a Scopus author identifier"""
 
-        # Extract the contents of the POST
-        length = int(self.headers["Content-Length"])
-        post_data = parse_qs(self.rfile.read(length).decode("utf-8"))
+    return re.fullmatch(r"(\d+-s2\.0-)?\d+", token) is not None
 
-        # Get POST data and initialize MattermostRequest object
-        request = MattermostRequest(post_data)
 
-        data = {}
+def gethindex(text, request=None):
+    """Return the response to be returned to the MM server and whether it should be private.
 
-        if request.command[0] != "/hindex" or request.token[0] != token:
-            data["text"] = "invalid request"
-            self.send_response(401)
-            self.wfile.write(json.dumps(data).encode("utf-8"))
-            return
+    If a response_url is provided, the lookups are done in background and
+    an acknowledgement is returned immediately.
+    """
 
-        if not request.text:
-            responsetext = gethindex("help")
-        else:
-            assert len(request.text) == 1
-            responsetext = gethindex(request.text[0])
+    if (
+        deferred is not None
+        and request is not None
+        and request.response_url
+        and text.split(" ")[0] == "get"
+    ):
+        if deferred.submit(request.response_url, lookup, text):
+            return ["Looking up the h-index, the result will follow shortly", True]
+        return ["Too many lookups in progress, please try again later", True]
 
-        # Send response HTTP 200 (OK) to MM server
-        data["response_type"] = "ephemeral" if responsetext[1] else "in_channel"
-        data["text"] = responsetext[0]
-        self.send_response(200)
-        self.send_header("Content-type", "application/json")
-        self.end_headers()
-        self.wfile.write(json.dumps(data).encode("utf-8"))
+    return lookup(text)
 
 
-def gethindex(text):
-    """Return the response to be returned to the MM server and whether it should be private"""
+def lookup(text):
+    """Return the response to a command and whether it should be private"""
 
     tokens = text.split(" ")
     assert len(tokens) > 0
@@ -75,12 +77,27 @@ def gethindex(text):
         response = "Retrieve the h-index of a scholar via Scopus"
         error = True
 
+    elif (
+        tokens[0] == "get"
+        and len(tokens) > 2
+        and all(is_eid(x) for x in tokens[1:])
+    ):
+        hindices = Hindex().get_by_eids(tokens[1:])
+        private = False
+        response = "| EID | h-index |\n|:----|:--------|\n"
+        for eid in tokens[1:]:
+            value = "not found" if hindices[eid] is None else hindices[eid]
+            response += f"| {eid} | {value} |\n"
+
     elif tokens[0] == "get":
         if len(tokens) == 2:
             hindex = Hindex().get_by_eid(tokens[1])
             islist = False
         elif len(tokens) == 3:
-            hindex, islist = Hindex().get_by_name(tokens[1], tokens[2])
+            try:
+                hindex, islist = Hindex().get_by_name(tokens[1], tokens[2])
+            except ScopusQueryError as err:
+                return [f"{err}: please search by EID", True]
         else:
             error = True
             response = "Invalid get command"
@@ -97,8 +114,12 @@ def gethindex(text):
                         "| EID | Affiliation | Town | Country |\n"
                         "|:----|:------------|:-----|:--------|\n"
                     )
-                    for row in hindex:
+                    for row in hindex[:MAX_ROWS]:
                         response += f"| {row[0]} | {row[1]} | {row[2]} | {row[3]} |\n"
+                    if len(hindex) > MAX_ROWS:
+                        response += (
+                            f"\n{len(hindex) - MAX_ROWS} more authors not shown\n"
+                        )
 
     else:
         error = True
@@ -116,6 +137,8 @@ def gethindex(text):
                 "shows this help\n"
                 "- `/hindex get EID`\n"
                 "return the h-index of a scholar by EID\n"
+                "- `/hindex get EID1 EID2 ...`\n"
+                "return the h-index of multiple scholars by EID\n"
                 "- `/hindex get first last`\n"
                 "return the h-index of a scholar by first and last name\n"
             ),
@@ -125,6 +148,48 @@ def gethindex(text):
     return [response, private]
 
 
+def slash_command(
+    token,
+    cache="",
+    cache_ttl=DEFAULT_CACHE_TTL,
+    cache_capacity=DEFAULT_CACHE_CAPACITY,
+    deferred_workers=DEFAULT_WORKERS,
+    deferred_depth=DEFAULT_DEPTH,
+    fake_latency=None,
+    scopus_pool=DEFAULT_SCOPUS_POOL,
+    scopus_timeout=DEFAULT_SCOPUS_TIMEOUT,
+):
+    """Return the /hindex slash command, with Scopus results cached in the given file
+    and lookups deferred to a pool of workers, if their number is positive.
+
+    If fake_latency is not None, Scopus is simulated with random results
+    returned after the given average latency, in seconds, otherwise the
+    queries share up to scopus_pool connections, and fail after being
+    stalled for scopus_timeout seconds.
+
+    The cache file can be used by other processes at the same time."""
+
+    global deferred
+    scopus_cache = configure_cache(cache, cache_ttl, cache_capacity)
+    if fake_latency is not None:
+        configure_scopus(FakeScopusClient(fake_latency))
+    else:
+        configure_scopus(pool_size=scopus_pool, timeout=scopus_timeout)
+    deferred = None
+    if deferred_workers > 0:
+        deferred = DeferredResponder(deferred_workers, deferred_depth)
+
+    def close():
+        if deferred is not None:
+            deferred.close()
+        scopus_cache.close()
+        close_scopus()
+
+    return slashserver.SlashCommand(
+        "/hindex", token, gethindex, close=close, pass_request=True
+    )
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         "Mattermost handle slash command to retrieve the h-index of a scholar via Scopus",
@@ -133,10 +198,74 @@ if __name__ == "__main__":
     parser.add_argument("--host", type=str, default="localhost", help="Host to bind.")
     parser.add_argument("--port", type=int, default=10000, help="Host to bind.")
     parser.add_argument("--token", type=str, default="", help="Token to match.")
+    parser.add_argument(
+        "--cache",
+        type=str,
+        default="",
+        help="File where to cache the results of Scopus queries.",
+    )
+    parser.add_argument(
+        "--cache_ttl",
+        type=float,
+        default=DEFAULT_CACHE_TTL,
+        help="Time, in seconds, after which cached results expire.",
+    )
+    parser.add_argument(
+        "--cache_capacity",
+        type=int,
+        default=DEFAULT_CACHE_CAPACITY,
+        help="Maximum number of cached results kept in memory.",
+    )
+    parser.add_argument(
+        "--deferred_workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help="Number of lookups done concurrently in background, "
+        "0 to reply synchronously.",
+    )
+    parser.add_argument(
+        "--deferred_depth",
+        type=int,
+        default=DEFAULT_DEPTH,
+        help="Maximum number of lookups waiting to be done in background.",
+    )
+    parser.add_argument(
+        "--scopus_pool",
+        type=int,
+        default=DEFAULT_SCOPUS_POOL,
+        help="Maximum number of connections open to Scopus.",
+    )
+    parser.add_argument(
+        "--scopus_timeout",
+        type=float,
+        default=DEFAULT_SCOPUS_TIMEOUT,
+        help="Time, in seconds, after which a stalled Scopus query fails.",
+    )
+    parser.add_argument(
+        "--fake_latency",
+        type=float,
+        default=None,
+        help="Simulate Scopus, for testing, with random results returned after "
+        "this average latency, in seconds.",
+    )
+    slashserver.add_arguments(parser)
     args = parser.parse_args()
 
-    token = args.token
-
-    with HTTPServer((args.host, args.port), PostHandler) as server:
-        print(f"Starting HTTP server at {args.host}:{args.port}, use <Ctrl-C> to stop")
-        server.serve_forever()
+    slashserver.serve(
+        args.host,
+        args.port,
+        lambda: [
+            slash_command(
+                args.token,
+                args.cache,
+                args.cache_ttl,
+                args.cache_capacity,
+                args.deferred_workers,
+                args.deferred_depth,
+                args.fake_latency,
+                args.scopus_pool,
+                args.scopus_timeout,
+            )
+        ],
+        **slashserver.options(args),
+    )
@@ -1,44 +1,78 @@
 """Simple class holding a slash command Mattermost request"""
 
+from urllib.parse import unquote_plus
+
+FIELDS = (
+    'response_url',
+    'text',
+    'token',
+    'channel_id',
+    'team_id',
+    'command',
+    'team_domain',
+    'user_name',
+    'channel_name',
+)
+REQUIRED = ('command', 'token')
+
+_FIELDS = frozenset(FIELDS)
+
+class MalformedRequest(ValueError):
+    """Raised when the body of a POST is not a valid slash command request"""
+
 class MattermostRequest(object):
     """
     This is what we get from Mattermost
     """
-    def __init__(self, mmdata):
+
+    __slots__ = FIELDS
+
+    def __init__(self, mmdata=None):
         """Initialize the MM request with the data from the server.
 
         Parameters
         ---------
             mmdata : dict
-                Dictionary representing the MM fields as read from the JSON in the POST.
+                Dictionary with the (string) values of the MM fields,
+                the other ones are ignored.
         """
 
-        self.response_url = None
-        self.text = None
-        self.token = None
-        self.channel_id = None
-        self.team_id = None
-        self.command = None
-        self.team_domain = None
-        self.user_name = None
-        self.channel_name = None
-
-        for key, value in mmdata.items():
-            if key == 'response_url':
-                self.response_url = value
-            elif key == 'text':
-                self.text = value
-            elif key == 'token':
-                self.token = value
-            elif key == 'channel_id':
-                self.channel_id = value
-            elif key == 'team_id':
-                self.team_id = value
-            elif key == 'command':
-                self.command = value
-            elif key == 'team_domain':
-                self.team_domain = value
-            elif key == 'user_name':
-                self.user_name = value
-            elif key == 'channel_name':
-                self.channel_name = value
+        for key in FIELDS:
+            setattr(self, key, None)
+        if mmdata:
+            for key, value in mmdata.items():
+                if key in _FIELDS:
+                    setattr(self, key, value)
+
+def parse(body):
+    """Return the MattermostRequest in the (form-urlencoded) body of a POST.
+
+    The body is decoded in a single pass, only the values of the known
+    fields are unquoted, and the others are skipped.
+
+    Raises
+    ------
+    MalformedRequest
+        If the body cannot be decoded, a field is repeated, or a
+        required field is missing or empty
+    """
+
+    request = MattermostRequest()
+    for pair in body.split('&'):
+        key, _, value = pair.partition('=')
+        if key not in _FIELDS:
+            continue
+        if getattr(request, key) is not None:
+            raise MalformedRequest(f'Duplicate field: {key}')
+        if '%' in value or '+' in value:
+            try:
+                value = unquote_plus(value, errors='strict')
+            except UnicodeDecodeError as err:
+                raise MalformedRequest(f'Invalid field {key}: {err}') from err
+        setattr(request, key, value)
+
+    for key in REQUIRED:
+        if not getattr(request, key):
+            raise MalformedRequest(f'Missing field: {key}')
+
+    return request
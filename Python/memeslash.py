@@ -13,55 +13,91 @@ Mattermost documentation:
     http://docs.mattermost.com/developer/slash-commands.html
 """
 
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from urllib.parse import parse_qs
-import json
 import argparse
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import Lock
 
 from persdic import PersDic
-from mattermostrequest import MattermostRequest
+from persdicpool import PersDicPool
+from persdicstorage import STORAGES
+import slashserver
+
+NAMESPACES = ['global', 'team', 'channel']
+PAGE_SIZE = 100
+TYPOS_PER_CHARS = 5
+MAX_TYPOS = 2
+LIST_CACHE_SIZE = 256
 
-token = None
 memes = None
+namespace = 'global'
+list_cache = OrderedDict()
+list_cache_lock = Lock()
+
+@contextmanager
+def memes_of(request):
+    """Return the dictionary of memes of the team (and channel) of a request,
+    or the global one"""
+
+    if namespace == 'global' or request is None:
+        yield memes
+        return
+
+    name = request.team_id or ''
+    if namespace == 'channel':
+        name += '-' + (request.channel_id or '')
+    with memes.acquire(name) as pers_dic:
+        yield pers_dic
+
+def getmeme(text, request=None):
+    """Return the response to be returned to the MM server and whether it should be private"""
 
-# guarantee unicode string
-_u = lambda t: t.decode('UTF-8', 'replace') if isinstance(t, str) else t
+    with memes_of(request) as memes:
+        return respond(text, memes)
+
+def render_list(memes, prefix, page):
+    """Return a page of the list of activation phrases with a given prefix.
+
+    The pages are cached by the version of the dictionary, hence they are
+    rendered again only after a change.
+    """
+
+    version = memes.version()
+    cache_key = (version, prefix, page)
+    with list_cache_lock:
+        response = list_cache.get(cache_key)
+        if response is not None:
+            list_cache.move_to_end(cache_key)
+            return response
+
+    meme_keys, total = memes.get_sorted_keys(prefix, (page - 1) * PAGE_SIZE, PAGE_SIZE)
+    pages = (total + PAGE_SIZE - 1) // PAGE_SIZE
+    starting = f' starting with `{prefix}`' if prefix else ''
+    if total == 0:
+        response = f'No activation phrases{starting} available'
+    elif not meme_keys:
+        response = f'Invalid page {page}, the last one is {pages}'
+    else:
+        of_pages = f' (page {page} of {pages})' if pages > 1 else ''
+        response = "Activation phrases{} available{}:\n{}".format(
+            starting, of_pages, '\n'.join([f'- {x}' for x in meme_keys]))
 
-class PostHandler(BaseHTTPRequestHandler):
-    def do_POST(self):
-        """Respond to a POST request."""
+    # do not cache if the dictionary has changed in the meanwhile
+    if memes.version() == version:
+        with list_cache_lock:
+            list_cache[cache_key] = response
+            if len(list_cache) > LIST_CACHE_SIZE:
+                list_cache.popitem(last=False)
 
-        # Extract the contents of the POST
-        length = int(self.headers['Content-Length'])
-        post_data = parse_qs(self.rfile.read(length).decode('utf-8'))
+    return response
 
-        # Get POST data and initialize MattermostRequest object
-        request = MattermostRequest(post_data)
+def max_typos(phrase):
+    """Return the maximum number of typos tolerated in an activation phrase"""
 
-        data = {}
+    return min(MAX_TYPOS, len(phrase) // TYPOS_PER_CHARS)
 
-        if request.command[0] != u'/meme' or request.token[0] != token:
-            data['text'] = 'invalid request'
-            self.send_response(401)
-            self.wfile.write(json.dumps(data).encode('utf-8'))
-            return
-
-        if not request.text:
-            responsetext = getmeme('help')
-        else:
-            assert len(request.text) == 1
-            responsetext = getmeme(request.text[0])
-
-        # Send response HTTP 200 (OK) to MM server
-        data['response_type'] = 'ephemeral' if responsetext[1] else 'in_channel'
-        data['text'] = responsetext[0]
-        self.send_response(200)
-        self.send_header("Content-type", "application/json")
-        self.end_headers()
-        self.wfile.write(json.dumps(data).encode('utf-8'))
-
-def getmeme(text):
-    """Return the response to be returned to the MM server and whether it should be private"""
+def respond(text, memes):
+    """Return the response to a command using the given dictionary of memes"""
 
     tokens = text.split(' ')
     assert len(tokens) > 0
@@ -71,12 +107,16 @@ def getmeme(text):
     private = True
 
     if tokens[0] == "list":
-        meme_keys = memes.get_keys()
-        if not meme_keys:
-            response = 'No activation phrases available'
+        args = tokens[1:]
+        page = 1
+        if args and args[-1].isdigit():
+            page = int(args.pop())
+        if len(args) > 1 or page < 1:
+            error = True
+            response = 'Invalid list command'
+
         else:
-            response = "Activation phrases available:\n{}".format(
-                '\n'.join([f'- {x}' for x in meme_keys]))
+            response = render_list(memes, args[0] if args else '', page)
 
     elif tokens[0] == "help":
         response = 'Show a configurable response in channel'
@@ -106,6 +146,8 @@ def getmeme(text):
 
         else:
             response = memes.get(tokens[0], exact=False)
+            if not response:
+                response = memes.get_closest(tokens[0], max_typos(tokens[0]))
             if not response:
                 response = f'invalid activation phrase `{tokens[0]}`'
             else:
@@ -119,19 +161,40 @@ def getmeme(text):
                "Commands:\n"
                "- `/meme help`\n"
                "shows this help\n"
-               "- `/meme list`\n"
-               "shows the list of activation phrases\n"
+               "- `/meme list [PREFIX] [PAGE]`\n"
+               f"shows the list of activation phrases, optionally only those starting with PREFIX, {PAGE_SIZE} per page\n"
                "- `/meme add KEY VALUE`\n"
                "add KEY as activation phrase that will show VALUE, possibly overriding a previous entry\n"
                "- `/meme del KEY`\n"
                "delete the activation phase KEY\n"
                "- `/meme PHRASE`\n"
-               "show a response partially matching the given PHRASE\n"),
+               "show a response partially matching the given PHRASE, or the closest one if mistyped\n"),
                True]
 
     return [response, private]
 
 
+def slash_command(token, persistence='persistence.json', storage='json',
+                  journal=False, write_behind=False, namespaces='global',
+                  budget=100000, shared=False):
+    """Return the /meme slash command, with memes stored in the given file,
+    or in the given directory with one file per namespace, which can be
+    shared with other processes if shared is true"""
+
+    global memes, namespace
+    if namespaces not in NAMESPACES:
+        raise ValueError(f'Invalid namespaces: {namespaces}')
+    namespace = namespaces
+    options = dict(storage=storage, journal=journal, write_behind=write_behind,
+                   shared=shared)
+    if namespace == 'global':
+        memes = PersDic(persistence, **options)
+    else:
+        memes = PersDicPool(persistence, budget, **options)
+    return slashserver.SlashCommand('/meme', token, getmeme, close=memes.close,
+                                    pass_request=True)
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         "Mattermost handle slash command to post meme URLs",
@@ -144,11 +207,32 @@ if __name__ == '__main__':
                         help="Token to match.")
     parser.add_argument("--persistence", type=str, default="persistence.json",
                         help="Name of the file containing the dictionary of meme URLs.")
+    parser.add_argument("--storage", type=str, default="json",
+                        choices=list(STORAGES.keys()),
+                        help="Storage backend of the dictionary of meme URLs.")
+    parser.add_argument("--journal", action="store_true", default=False,
+                        help="Append changes to a journal instead of rewriting the dictionary.")
+    parser.add_argument("--write_behind", action="store_true", default=False,
+                        help="Save changes to file in background.")
+    parser.add_argument("--namespaces", type=str, default="global",
+                        choices=NAMESPACES,
+                        help="Use separate dictionaries per team or channel, "
+                        "in the directory specified with --persistence.")
+    parser.add_argument("--budget", type=int, default=100000,
+                        help="Maximum number of entries loaded with namespaces.")
+    slashserver.add_arguments(parser)
     args = parser.parse_args()
 
-    token = args.token
-    memes = PersDic(args.persistence)
-
-    with HTTPServer((args.host, args.port), PostHandler) as server:
-        print(f'Starting HTTP server at {args.host}:{args.port}, use <Ctrl-C> to stop')
-        server.serve_forever()
+    # with multiple processes the files are shared by all of them
+    shared = args.processes > 1
+    if shared and (args.journal or args.write_behind):
+        parser.error('--journal and --write_behind require a single process')
+
+    slashserver.serve(
+        args.host,
+        args.port,
+        lambda: [slash_command(args.token, args.persistence, args.storage,
+                               args.journal, args.write_behind,
+                               args.namespaces, args.budget, shared)],
+        **slashserver.options(args),
+    )
@@ -0,0 +1,335 @@
+"""
+Metrics of the bots, exposed in the Prometheus text format.
+
+Every metric is created once, usually when its module is imported, with
+counter(), gauge(), or histogram(), and kept in a registry shared by the
+whole process. render() returns the current value of all the metrics,
+which serve_metrics() makes available at /metrics on an admin port,
+together with optional admin routes, e.g., to start profiling, which are
+only executed upon a POST with the admin token.
+
+Recording a value only takes a lock, plus a bisection of the bucket bounds
+for histograms, hence the metrics are always enabled.
+"""
+
+import hmac
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+
+# upper bounds, in seconds, of the buckets of the latency histograms
+DEFAULT_BUCKETS = (
+    0.0001,
+    0.0005,
+    0.001,
+    0.005,
+    0.01,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_registry = dict()
+_registry_lock = Lock()
+
+
+def _escape(value):
+    """Return a label value escaped for the text format"""
+
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=""):
+    """Return the label set of a sample, e.g., {command="/meme",status="200"}"""
+
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric(object):
+    """Base class of the metrics, with a value for every set of label values"""
+
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        """Initialize the metric.
+
+        Parameters
+        ---------
+        name : str
+            The name of the metric
+
+        help : str
+            The description of the metric
+
+        labels : tuple
+            The names of the labels, whose values are passed, in the same
+            order, every time a value is recorded
+        """
+
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = dict()
+        self._lock = Lock()
+
+    def _check(self, values):
+        if len(values) != len(self.labels):
+            raise ValueError(
+                f"Metric {self.name} expects labels {self.labels}, got {values}"
+            )
+
+    def render(self):
+        """Return the lines of the metric in the text format"""
+
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            values = sorted(self._values.items(), key=lambda x: str(x[0]))
+        for labels, value in values:
+            lines.append(f"{self.name}{_labels(self.labels, labels)} {value}")
+        return lines
+
+
+class Counter(Metric):
+    """Value that can only increase, e.g., the number of requests"""
+
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        """Increase the value of the given label values"""
+
+        self._check(labels)
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """Value that can go up and down, e.g., the number of requests in flight"""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=(), function=None):
+        """Initialize the gauge.
+
+        If function is not None, it is called without arguments every time
+        the metric is rendered, and it returns its value, which must not
+        depend on labels.
+        """
+
+        super().__init__(name, help, labels)
+        self._function = function
+        if function is not None and self.labels:
+            raise ValueError(f"Metric {name} with a function cannot have labels")
+
+    def inc(self, *labels, amount=1):
+        """Increase the value of the given label values"""
+
+        self._check(labels)
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        """Decrease the value of the given label values"""
+
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value, *labels):
+        """Set the value of the given label values"""
+
+        self._check(labels)
+        with self._lock:
+            self._values[labels] = value
+
+    def render(self):
+        if self._function is not None:
+            with self._lock:
+                self._values[()] = self._function()
+        return super().render()
+
+
+class Timer(object):
+    """Context manager recording in a histogram the time spent in its body"""
+
+    __slots__ = ("_histogram", "_labels", "_start")
+
+    def __init__(self, histogram, labels):
+        self._histogram = histogram
+        self._labels = labels
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._histogram.observe(time.perf_counter() - self._start, *self._labels)
+
+
+class Histogram(Metric):
+    """Distribution of values, e.g., latencies, counted in buckets"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        """Initialize the histogram, whose buckets have the given upper
+        bounds, in increasing order, plus an unbounded one"""
+
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        """Record a value for the given label values"""
+
+        self._check(labels)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                # counts per bucket, sum of the values
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][i] += 1
+            entry[1] += value
+
+    def time(self, *labels):
+        """Return a context manager recording the time spent in its body"""
+
+        return Timer(self, labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            values = sorted(
+                ((k, list(v[0]), v[1]) for k, v in self._values.items()),
+                key=lambda x: str(x[0]),
+            )
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                label_set = _labels(self.labels, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{label_set} {cumulative}")
+            label_set = _labels(self.labels, labels)
+            lines.append(f"{self.name}_sum{label_set} {total}")
+            lines.append(f"{self.name}_count{label_set} {cumulative}")
+        return lines
+
+
+def _register(cls, name, help, labels, **options):
+    """Return the metric with the given name, created if not existing"""
+
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = cls(name, help, labels, **options)
+        elif type(metric) is not cls or metric.labels != tuple(labels):
+            raise ValueError(f"Metric {name} already registered differently")
+        return metric
+
+
+def counter(name, help, labels=()):
+    """Return the Counter with the given name, created if not existing"""
+
+    return _register(Counter, name, help, labels)
+
+
+def gauge(name, help, labels=(), function=None):
+    """Return the Gauge with the given name, created if not existing"""
+
+    return _register(Gauge, name, help, labels, function=function)
+
+
+def histogram(name, help, labels=(), buckets=DEFAULT_BUCKETS):
+    """Return the Histogram with the given name, created if not existing"""
+
+    return _register(Histogram, name, help, labels, buckets=buckets)
+
+
+def render():
+    """Return all the metrics in the text format"""
+
+    with _registry_lock:
+        metrics = list(_registry.values())
+    lines = []
+    for metric in metrics:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        """Respond with the metrics to a GET of /metrics"""
+
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+
+        payload = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        """Execute an admin route, if the request has the admin token in
+        the header Authorization: Bearer TOKEN"""
+
+        route = self.server.routes.get(self.path.split("?")[0])
+        if route is None:
+            self.send_error(404)
+            return
+
+        token = self.server.token
+        authorization = self.headers.get("Authorization", "")
+        if not token or not hmac.compare_digest(
+            authorization.encode("utf-8"), f"Bearer {token}".encode("utf-8")
+        ):
+            self.send_error(403)
+            return
+
+        payload = (route() + "\n").encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_request(self, code="-", size="-"):
+        pass
+
+
+def serve_metrics(host, port, routes=None, token=""):
+    """Serve the metrics at /metrics in a background thread, return the
+    server, to be stopped with shutdown() and server_close().
+
+    Parameters
+    ---------
+    host : str
+        Host to bind
+
+    port : int
+        Port to bind
+
+    routes : dict
+        The admin routes, from path to a function called without arguments
+        returning a message
+
+    token : str
+        The token needed to POST to the admin routes, which are disabled
+        if empty
+    """
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    server.routes = routes or dict()
+    server.token = token
+    Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Serve multiple Mattermost slash commands in a single process on one port.
+
+The commands are loaded from a JSON configuration file, e.g.:
+
+{
+    "host": "localhost",
+    "port": 10000,
+    "mode": "threaded",
+    "workers": 8,
+    "commands": [
+        {"module": "memeslash", "token": "TOKEN1",
+         "options": {"persistence": "persistence.json"}},
+        {"module": "hindexslash", "token": "TOKEN2"},
+        {"module": "cceslash", "token": "TOKEN3", "options": {"names": "names"}},
+        {"module": "cerino", "token": "TOKEN4"}
+    ]
+}
+
+Each module must provide a function slash_command(token, **options)
+returning the SlashCommand to be served: the requests are dispatched
+to the handler of the command received, after checking its own token.
+The top-level "host" and "port", and the options of the server, e.g.,
+"mode" and "workers", are optional and can be overridden from the
+command line.
+
+With multiple "processes", the commands using files share them with the
+other processes, as when run on their own: "shared" is set to true for
+those having such an option, e.g., memeslash, which then cannot use
+"journal" or "write_behind".
+"""
+
+import argparse
+import importlib
+import inspect
+import json
+
+import slashserver
+
+
+def load_commands(config):
+    """Return the list of SlashCommand objects from the given configuration"""
+
+    slash_commands = []
+    for entry in config.get("commands", []):
+        module = importlib.import_module(entry["module"])
+        slash_commands.append(
+            module.slash_command(entry.get("token", ""), **entry.get("options", {}))
+        )
+    return slash_commands
+
+
+def share_files(config):
+    """Return the configuration with the option "shared" set to true for the
+    commands having it, raise ValueError if their options prevent sharing"""
+
+    commands = []
+    for entry in config.get("commands", []):
+        module = importlib.import_module(entry["module"])
+        options = dict(entry.get("options", {}))
+        if "shared" in inspect.signature(module.slash_command).parameters:
+            if options.get("journal") or options.get("write_behind"):
+                raise ValueError(
+                    f'{entry["module"]}: "journal" and "write_behind" '
+                    "require a single process"
+                )
+            options["shared"] = True
+        commands.append(dict(entry, options=options))
+    return dict(config, commands=commands)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        "Mattermost handle multiple slash commands on the same port",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--config", type=str, default="mmbots.json", help="Configuration file."
+    )
+    parser.add_argument(
+        "--host", type=str, default=None, help="Host to bind, overrides config."
+    )
+    parser.add_argument(
+        "--port", type=int, default=None, help="Port to bind, overrides config."
+    )
+    slashserver.add_arguments(parser, overrides=True)
+    args = parser.parse_args()
+
+    with open(args.config, "r") as config_file:
+        config = json.load(config_file)
+
+    if not config.get("commands"):
+        raise RuntimeError(f"No commands found in {args.config}")
+
+    server_options = slashserver.options(args, config)
+    # with multiple processes the files are shared by all of them
+    if server_options["processes"] > 1:
+        try:
+            config = share_files(config)
+        except ValueError as err:
+            parser.error(str(err))
+
+    print(
+        "Serving commands from: {}".format(
+            " ".join([x["module"] for x in config["commands"]])
+        )
+    )
+
+    slashserver.serve(
+        args.host or config.get("host", "localhost"),
+        args.port or config.get("port", 10000),
+        lambda: load_commands(config),
+        **server_options,
+    )
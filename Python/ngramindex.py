@@ -0,0 +1,250 @@
+"""
+N-gram index to find the strings containing a given substring.
+
+Every string added is indexed by all its substrings of length 1 to n,
+called grams. The strings containing a query are found by intersecting
+the sets of strings containing the grams of the query, starting from
+the smallest, and then verifying the candidates left: the cost depends
+on the number of strings sharing the rarest grams of the query, rather
+than on the total number of strings indexed.
+
+Matches are returned in a deterministic order: shortest string first,
+then in lexicographic order.
+
+The index can also find the string closest to a given one, within a
+maximum number of edits (insertions, deletions, substitutions, and
+transpositions). Each edit changes at most g + 1 grams of length g, hence
+a string within k edits shares at least one of any k * (g + 1) + 1 grams
+of the query: only the strings of the rarest of them are candidates,
+which are then verified by computing their edit distance, up to a
+maximum number of candidates.
+
+An index can be read by multiple threads while another one changes it,
+since lookups only copy, intersect, and count the sets of strings of the
+grams, which are atomic operations.
+"""
+
+import heapq
+from collections import Counter
+
+MAX_CANDIDATES = 1000
+
+
+def rank(string):
+    """Return the sorting key of the matches"""
+
+    return (len(string), string)
+
+
+def edit_distance(a, b, bound):
+    """Return the edit distance between two strings, if at most bound,
+    otherwise bound + 1.
+
+    The edits are insertions, deletions, substitutions, and transpositions
+    of adjacent characters (optimal string alignment distance).
+    """
+
+    if abs(len(a) - len(b)) > bound:
+        return bound + 1
+
+    before = None
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            distance = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != char_b),
+            )
+            if (
+                before is not None
+                and j > 1
+                and char_a == b[j - 2]
+                and a[i - 2] == char_b
+            ):
+                distance = min(distance, before[j - 2] + 1)
+            current.append(distance)
+        if min(current) > bound:
+            return bound + 1
+        before = previous
+        previous = current
+
+    return min(previous[-1], bound + 1)
+
+
+class NgramIndex(object):
+    def __init__(self, strings=(), n=3):
+        """Initialize the index.
+
+        Parameters
+        ---------
+        strings : iterable
+            The strings initially indexed
+
+        n : int
+            The maximum length of the grams indexed
+        """
+
+        assert n > 0
+        self._n = n
+        self._postings = dict()
+        self._strings = set()
+        for string in strings:
+            self.add(string)
+
+    def __len__(self):
+        return len(self._strings)
+
+    def __contains__(self, string):
+        return string in self._strings
+
+    def add(self, string):
+        """Add a string to the index, if not already present"""
+
+        if string in self._strings:
+            return
+        self._strings.add(string)
+        for gram in self._grams(string):
+            self._postings.setdefault(gram, set()).add(string)
+
+    def remove(self, string):
+        """Remove a string from the index, if present"""
+
+        if string not in self._strings:
+            return
+        self._strings.discard(string)
+        for gram in self._grams(string):
+            posting = self._postings[gram]
+            posting.discard(string)
+            if not posting:
+                del self._postings[gram]
+
+    def find(self, substring, limit=None):
+        """Return the sorted list of strings containing a substring
+
+        Parameters
+        ---------
+        substring : str
+            The substring to search
+
+        limit : int
+            If not None, return at most this number of matches
+        """
+
+        if limit is None:
+            return sorted(self._matches(substring), key=rank)
+        return heapq.nsmallest(limit, self._matches(substring), key=rank)
+
+    def closest(self, string, max_distance, max_candidates=MAX_CANDIDATES):
+        """Return the string closest to a given one, or None
+
+        Parameters
+        ---------
+        string : str
+            The string to search
+
+        max_distance : int
+            The maximum edit distance of the string returned, reduced
+            for strings too short to be filtered by their grams
+
+        max_candidates : int
+            The maximum number of candidates verified, those sharing
+            more grams with the string first
+        """
+
+        if string in self._strings:
+            return string
+
+        # use the longest grams that still leave enough of them to filter,
+        # if none then the string is too short for max_distance edits
+        length = len(string)
+        for gram_length in range(min(self._n, length), 0, -1):
+            if length - gram_length + 1 > max_distance * (gram_length + 1):
+                break
+        else:
+            if max_distance <= 1:
+                return None
+            return self.closest(string, max_distance - 1, max_candidates)
+
+        grams = [
+            string[start : start + gram_length]
+            for start in range(length - gram_length + 1)
+        ]
+        grams.sort(key=lambda x: len(self._postings.get(x, ())))
+
+        shared = Counter()
+        for gram in grams[: max_distance * (gram_length + 1) + 1]:
+            shared.update(self._postings.get(gram, ()))
+
+        # a string within max_distance edits contains at least this number
+        # of the grams of the query, which is cheaper to check
+        min_shared = len(grams) - max_distance * (gram_length + 1)
+
+        best = None
+        for candidate in heapq.nlargest(max_candidates, shared, key=shared.get):
+            if abs(len(candidate) - length) > max_distance or (
+                min_shared > 1 and sum(x in candidate for x in grams) < min_shared
+            ):
+                continue
+            distance = edit_distance(string, candidate, max_distance)
+            if distance <= max_distance and (
+                best is None or (distance, rank(candidate)) < best[0]
+            ):
+                best = ((distance, rank(candidate)), candidate)
+
+        return None if best is None else best[1]
+
+    def count(self, substring):
+        """Return the number of strings containing a substring"""
+
+        if 0 < len(substring) <= self._n:
+            # the substring is itself a gram: no need to copy its strings
+            return len(self._postings.get(substring, ()))
+        return len(self._matches(substring))
+
+    def first(self, substring):
+        """Return the first string containing a substring, or None"""
+
+        return min(self._matches(substring), key=rank, default=None)
+
+    def _grams(self, string):
+        """Return the set of grams of a string"""
+
+        grams = set()
+        for length in range(1, min(self._n, len(string)) + 1):
+            for start in range(len(string) - length + 1):
+                grams.add(string[start : start + length])
+        return grams
+
+    def _matches(self, substring):
+        """Return the (unsorted) strings containing a substring"""
+
+        if not substring:
+            return set(self._strings)
+
+        length = min(self._n, len(substring))
+        grams = {
+            substring[start : start + length]
+            for start in range(len(substring) - length + 1)
+        }
+
+        postings = []
+        for gram in grams:
+            posting = self._postings.get(gram)
+            if not posting:
+                return set()
+            postings.append(posting)
+        postings.sort(key=len)
+
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            if len(candidates) <= 1:
+                break
+            candidates &= posting
+
+        if length == len(substring):
+            # the substring is itself a gram: no verification needed
+            return candidates
+
+        return {x for x in candidates if substring in x}
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Copy the entries of a persistent dictionary between storage backends.
+
+Example, to move the memes from the default JSON file to SQLite:
+
+./persdic-migrate.py --input persistence.json --input_storage json \
+                     --output persistence.db --output_storage sqlite
+"""
+
+import argparse
+
+from persdicstorage import STORAGES, make_storage, migrate
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        "Copy a persistent dictionary between storage backends",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--input", type=str, default="persistence.json", help="Input file."
+    )
+    parser.add_argument(
+        "--input_storage",
+        type=str,
+        default="json",
+        choices=list(STORAGES.keys()),
+        help="Storage backend of the input file.",
+    )
+    parser.add_argument(
+        "--output", type=str, default="persistence.db", help="Output file."
+    )
+    parser.add_argument(
+        "--output_storage",
+        type=str,
+        default="sqlite",
+        choices=list(STORAGES.keys()),
+        help="Storage backend of the output file.",
+    )
+    args = parser.parse_args()
+
+    try:
+        if args.input == args.output:
+            raise Exception("Input and output files must be different")
+
+        copied = migrate(
+            make_storage(args.input_storage, args.input),
+            make_storage(args.output_storage, args.output),
+        )
+        print(f"Copied {copied} entries from {args.input} to {args.output}")
+
+    except Exception as err:
+        print(f"Error: {err}")
@@ -1,33 +1,257 @@
 #!/usr/bin/env python3
-"""Simple thread-safe dictionary persistent on file"""
+"""Simple thread-safe dictionary persistent on file
+
+The dictionary is saved by a storage backend, see persdicstorage.py:
+
+- json (default): JSON file kept in memory, optionally with a journal
+- sqlite: SQLite database, whose values are read from disk when needed
+
+The keys are indexed in memory by their n-grams, to find quickly those
+partially matching a given string, and kept sorted, to find quickly
+those with a given prefix.
+
+Every change increments the version of the dictionary, which can be used
+to invalidate data derived from it. Versions are unique across all the
+dictionaries of a process.
+
+Reads do not lock: writers, serialized by a lock, change the dictionary,
+its index, and the sorted keys in place, while readers only do operations
+that are atomic, e.g., reading a single key of a dict or copying a set.
+get_all() and get_keys() return copies, which take a time linear in the
+size of the dictionary, unlike reads and writes of single entries, and
+the number of entries, via len().
+
+In write-behind mode changes are only applied in memory, while a
+background thread saves them in a single write when a given number of
+changes are pending or after a given time, whichever comes first.
+Changes not yet saved are lost if the process crashes, thus flush() or
+close() must be called before exiting. This mode is not available with
+storages that are read lazily.
+
+In shared mode the same file can be used by multiple processes, e.g., the
+workers of a bot. Changes are serialized by a lock on a file next to the
+dictionary (with suffix .lock), which also holds a generation number
+incremented at every change. Every read first checks the generation
+number, which is cheap, and only if another process has changed the
+dictionary it loads it again, updating the index with the keys added or
+removed. Journal and write-behind modes are not available in shared mode,
+since the changes would not be visible to the other processes.
+
+The time spent reading, changing, saving, and loading the dictionaries
+is recorded in the metrics, see metrics.py.
+"""
 
 import argparse
-import json
-from threading import Lock
+import fcntl
+import itertools
+import os
+from bisect import bisect_left, insort
+from collections.abc import Mapping
+from contextlib import contextmanager, nullcontext
+from threading import Event, Lock, Thread
+from types import MappingProxyType
+
+import metrics
+from ngramindex import NgramIndex
+from persdicstorage import STORAGES, make_storage
+
+_versions = itertools.count()
+
+SECONDS = metrics.histogram(
+    'mmbots_persdic_seconds',
+    'Time to read, write (including the save, unless in write-behind mode), '
+    'save to file, and load the dictionaries.',
+    ('operation',))
+
+# in shared mode, the maximum number of keys added or removed by another
+# process that are updated in the index, rather than rebuilding it
+MAX_INCREMENTAL = 1000
+
+class Generation(object):
+    """Generation number of a dictionary shared by multiple processes,
+    kept in a lock file"""
 
-class PersDic(object):
     def __init__(self, filename):
+        self._fd = os.open(f'{filename}.lock', os.O_RDWR | os.O_CREAT, 0o644)
+
+    def read(self):
+        """Return the current generation number"""
+
+        try:
+            return int(os.pread(self._fd, 20, 0) or 0)
+        except ValueError:
+            return -1
+
+    @contextmanager
+    def locked(self, exclusive=True):
+        """Hold the lock of the file in the with block"""
+
+        fcntl.flock(self._fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def increment(self):
+        """Increment the generation number, with the lock held, return it"""
+
+        generation = max(0, self.read()) + 1
+        os.pwrite(self._fd, f'{generation:020d}'.encode(), 0)
+        return generation
+
+    def close(self):
+        os.close(self._fd)
+
+class LazyContent(Mapping):
+    """Read-only dictionary whose keys are in memory, while the values
+    are read from a lazy storage"""
+
+    def __init__(self, keys, storage):
+        self._keys = keys
+        self._storage = storage
+
+    def __getitem__(self, key):
+        value = self._storage.get(key) if key in self._keys else None
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def items(self):
+        """Return all the (key, value) pairs, read with a single query"""
+
+        return [(k, v) for k, v in self._storage.items() if k in self._keys]
+
+    def copy(self):
+        """Return a dictionary with all the entries"""
+
+        return dict(self.items())
+
+    def add_key(self, key):
+        """Add a key, whose value is in the storage"""
+
+        self._keys.add(key)
+
+    def remove_key(self, key):
+        """Remove a key"""
+
+        self._keys.discard(key)
+
+class PersDic(object):
+    def __init__(self, filename, storage='json', journal=False,
+                 compact_every=1000, compact_interval=60.0, write_behind=False,
+                 flush_count=100, flush_interval=1.0, fsync=False,
+                 shared=False):
+        """Load the dictionary from file, if it exists.
+
+        Parameters
+        ----------
+        filename : str
+            The name of the file containing the dictionary
+
+        storage : str
+            The storage backend, one of STORAGES
+
+        journal : bool
+            With json storage, append changes to a journal file instead
+            of writing the full dictionary at every change
+
+        compact_every : int
+            In journal mode, compact as soon as the journal has this
+            number of records
+
+        compact_interval : float
+            In journal mode, compact the records in the journal, if any,
+            at least every this number of seconds
+
+        write_behind : bool
+            If true then save the changes to file in background
+
+        flush_count : int
+            In write-behind mode, save as soon as this number of changes
+            are pending
+
+        flush_interval : float
+            In write-behind mode, save the pending changes, if any,
+            at least every this number of seconds
+
+        fsync : bool
+            Force the changes to disk after every write
+
+        shared : bool
+            If true then the file can be changed by other processes, too
+        """
+
+        if shared and (journal or write_behind):
+            raise ValueError(
+                'Journal and write-behind modes not available in shared mode')
+
+        if storage == 'json':
+            options = dict(journal=journal, compact_every=compact_every,
+                           compact_interval=compact_interval, fsync=fsync)
+        elif journal:
+            raise ValueError(f'Journal mode not available with {storage} storage')
+        else:
+            options = dict(fsync=fsync)
+        self._storage = make_storage(storage, filename, **options)
+
+        if write_behind and self._storage.lazy:
+            raise ValueError(
+                f'Write-behind mode not available with {storage} storage')
 
         self._lock = Lock()
         self.filename = filename
-        self._content = dict()
-        try:
-            with open(filename, 'r') as pers_file:
-                self._content = json.load(pers_file)
-        except FileNotFoundError:
-            pass
+
+        self._generation = Generation(filename) if shared else None
+        self._seen = None
+        with self._shared(), SECONDS.time('load'):
+            self._content = self._load()
+            self._index = NgramIndex(self._content.keys())
+            self._sorted_keys = sorted(self._content.keys())
+            self._version = next(_versions)
+
+        self._write_behind = write_behind
+        self._flush_count = flush_count
+        self._pending = []
+        self._flush_lock = Lock()
+        self._flush_needed = Event()
+        self._stopped = False
+        self._flusher = None
+
+        if write_behind:
+            self._flusher = Thread(target=self._flush_loop,
+                                   args=(flush_interval,),
+                                   daemon=True)
+            self._flusher.start()
 
     def get_all(self):
-        """Return the full dictionary"""
+        """Return a read-only copy of the full dictionary, not affected by
+        later changes"""
 
-        with self._lock:
-            return self._content
+        self._current()
+        return MappingProxyType(self._content.copy())
 
     def get_keys(self):
-        """Return the list of keys in the dictionary"""
+        """Return the sorted list of keys in the dictionary, not affected by
+        later changes"""
 
-        with self._lock:
-            return self._content.keys()
+        self._current()
+        # copying a list is atomic, and it does not read lazy values
+        return self._sorted_keys[:]
+
+    def __len__(self):
+        """Return the number of entries in the dictionary"""
+
+        self._current()
+        return len(self._content)
 
     def get(self, key, exact = True):
         """Return one value from the dictionary
@@ -39,7 +263,8 @@ class PersDic(object):
 
         exact : bool
             If true then do an exact search, otherwise return
-            the first entry with a partial match
+            the entry with the shortest key partially matching,
+            the first in lexicographic order in case of ties
 
         Returns
         -------
@@ -47,14 +272,87 @@ class PersDic(object):
         no match was found
         """
 
-        with self._lock:
+        with SECONDS.time('read'):
+            self._current()
             if exact:
                 return self._content.get(key)
 
-            for k, v in self._content.items():
-                if key in k:
-                    return v
-            return None
+            match = self._index.first(key)
+            return None if match is None else self._content.get(match)
+
+    def get_closest(self, key, max_distance):
+        """Return the value of the key closest to a given one, or None
+
+        Parameters
+        ---------
+        key : str
+            The key to search in the dictionary
+
+        max_distance : int
+            The maximum number of edits, i.e., insertions, deletions, and
+            substitutions of single characters, between the two keys:
+            among the keys at the minimum distance, the one returned is
+            the shortest, the first in lexicographic order in case of ties
+        """
+
+        with SECONDS.time('read'):
+            self._current()
+            match = self._index.closest(key, max_distance)
+            return None if match is None else self._content.get(match)
+
+    def get_partial_keys(self, key, limit=None):
+        """Return the sorted list of keys partially matching a string
+
+        Parameters
+        ---------
+        key : str
+            The string to search in the keys
+
+        limit : int
+            If not None, return at most this number of keys
+        """
+
+        with SECONDS.time('read'):
+            self._current()
+            return self._index.find(key, limit)
+
+    def get_sorted_keys(self, prefix='', offset=0, limit=None):
+        """Return the sorted list of keys with a given prefix
+
+        Parameters
+        ---------
+        prefix : str
+            The prefix of the keys, all the keys if empty
+
+        offset : int
+            The number of keys to skip
+
+        limit : int
+            If not None, return at most this number of keys
+
+        Returns
+        -------
+        the list of keys and the total number of keys with the prefix
+        """
+
+        with SECONDS.time('read'):
+            self._current()
+            sorted_keys = self._sorted_keys
+            lo = bisect_left(sorted_keys, prefix)
+            hi = len(sorted_keys)
+            if prefix:
+                hi = bisect_left(sorted_keys, prefix + chr(0x10ffff))
+            start = min(lo + offset, hi)
+            end = hi if limit is None else min(start + limit, hi)
+            # a key may be added or removed between the bisections
+            return [x for x in sorted_keys[start:end]
+                    if x.startswith(prefix)], hi - lo
+
+    def version(self):
+        """Return the current version of the dictionary"""
+
+        self._current()
+        return self._version
 
     def add(self, key, value):
         """Add a new entry and save to file.
@@ -68,11 +366,22 @@ class PersDic(object):
             The value of the pair to be added
         """
 
-        with self._lock:
-            if self._content.get(key) == value:
+        with self._lock, self._shared(), SECONDS.time('write'):
+            self._refresh()
+            content = self._content
+            if content.get(key) == value:
                 return
-            self._content[key] = value
-            self._serialize()
+            if isinstance(content, LazyContent):
+                # the value must be stored before the key is visible
+                self._save(['add', key, value], content)
+                content.add_key(key)
+            else:
+                content[key] = value
+                self._save(['add', key, value], content)
+            if key not in self._index:
+                self._index.add(key)
+                insort(self._sorted_keys, key)
+            self._version = next(_versions)
 
     def delete(self, key):
         """Delete an entry from directionary and save to file.
@@ -88,18 +397,135 @@ class PersDic(object):
            True if the entry was delete, False otherwise.
         """
 
+        with self._lock, self._shared(), SECONDS.time('write'):
+            self._refresh()
+            content = self._content
+            if key not in content:
+                return False
+            if isinstance(content, LazyContent):
+                content.remove_key(key)
+            else:
+                del content[key]
+            self._index.remove(key)
+            del self._sorted_keys[bisect_left(self._sorted_keys, key)]
+            self._save(['del', key], content)
+            self._version = next(_versions)
+            return True
+
+    def flush(self):
+        """Save the changes pending in write-behind mode, if any.
+
+        The pending changes are collected while holding the lock, but
+        they are saved without it.
+        """
+
+        with self._flush_lock:
+            with self._lock:
+                records = self._pending
+                self._pending = []
+                content = self._content
+            if records:
+                with SECONDS.time('save'):
+                    self._storage.write(records, content)
+
+    def close(self):
+        """Stop the background thread, if any, then save the pending
+        changes and close the storage.
+
+        Changes made after closing are saved synchronously.
+        """
+
+        self._stopped = True
+        if self._flusher is not None:
+            self._flush_needed.set()
+            self._flusher.join()
+            self._flusher = None
+
+        self.flush()
         with self._lock:
-            if self._content.pop(key, None):
-                self._serialize()
-                return True
-            return False
+            self._write_behind = False
+        self._storage.close()
+        if self._generation is not None:
+            self._generation.close()
 
-    def _serialize(self):
-        """Write the dictionary to file"""
+    def _save(self, record, content):
+        """Save a change, or queue it in write-behind mode"""
 
         assert self._lock.locked()
-        with open(self.filename, 'w') as pers_file:
-            json.dump(self._content, pers_file)
+        if self._write_behind:
+            self._pending.append(record)
+            if len(self._pending) >= self._flush_count:
+                self._flush_needed.set()
+            return
+
+        with SECONDS.time('save'):
+            self._storage.write([record], content)
+        if self._generation is not None:
+            self._seen = self._generation.increment()
+
+    def _shared(self, exclusive=True):
+        """Return a context manager holding the lock of the file in shared
+        mode, doing nothing otherwise"""
+
+        if self._generation is None:
+            return nullcontext()
+        return self._generation.locked(exclusive)
+
+    def _load(self):
+        """Return the content read from the storage, recording the
+        generation number in shared mode, whose lock must be held"""
+
+        if self._generation is not None:
+            self._seen = self._generation.read()
+        if self._storage.lazy:
+            return LazyContent(set(self._storage.keys()), self._storage)
+        return self._storage.load()
+
+    def _current(self):
+        """Load the changes made by other processes, if any, in shared mode"""
+
+        if (self._generation is not None
+                and self._generation.read() != self._seen):
+            with self._lock, self._shared(exclusive=False):
+                self._refresh()
+
+    def _refresh(self):
+        """Load the dictionary again, if changed by other processes, and
+        update the index with the keys added or removed"""
+
+        assert self._generation is None or self._lock.locked()
+        if self._generation is None or self._generation.read() == self._seen:
+            return
+
+        with SECONDS.time('load'):
+            old = self._content
+            content = self._load()
+            added = content.keys() - old.keys()
+            removed = old.keys() - content.keys()
+            if len(added) + len(removed) > MAX_INCREMENTAL:
+                self._index = NgramIndex(content.keys())
+                self._sorted_keys = sorted(content.keys())
+                self._content = content
+            else:
+                # the keys added are indexed before being visible, and
+                # those removed are not visible before being unindexed
+                for key in added:
+                    self._index.add(key)
+                    insort(self._sorted_keys, key)
+                self._content = content
+                for key in removed:
+                    self._index.remove(key)
+                    del self._sorted_keys[bisect_left(self._sorted_keys, key)]
+            self._version = next(_versions)
+
+    def _flush_loop(self, flush_interval):
+        """Save the pending changes when needed until closed"""
+
+        while not self._stopped:
+            self._flush_needed.wait(timeout=flush_interval)
+            self._flush_needed.clear()
+            if not self._stopped:
+                self.flush()
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
@@ -117,11 +543,25 @@ if __name__ == '__main__':
                         help="Return the value for this entry (exact match).")
     parser.add_argument("--get_partial", type=str, default="",
                         help="Return a value for this entry (partial match).")
+    parser.add_argument("--get_closest", type=str, default="",
+                        help="Return the value for the closest entry (with typos).")
+    parser.add_argument("--max_distance", type=int, default=2,
+                        help="Maximum number of typos with --get_closest.")
+    parser.add_argument("--keys_partial", type=str, default="",
+                        help="Return the keys partially matching this entry.")
     parser.add_argument("--keys", action="store_true", default=False,
                         help="Return the list of keys.")
+    parser.add_argument("--storage", type=str, default="json",
+                        choices=list(STORAGES.keys()),
+                        help="Storage backend.")
+    parser.add_argument("--journal", action="store_true", default=False,
+                        help="Append changes to a journal file (json storage).")
+    parser.add_argument("--shared", action="store_true", default=False,
+                        help="Lock the file, shared with running bots.")
     args = parser.parse_args()
 
-    pers_dic = PersDic(args.file)
+    pers_dic = PersDic(args.file, storage=args.storage, journal=args.journal,
+                       shared=args.shared)
     
     if args.delete:
         removed = 'removed' if pers_dic.delete(args.delete) else 'not found'
@@ -137,6 +577,13 @@ if __name__ == '__main__':
     if args.get_partial:
         print(pers_dic.get(args.get_partial, exact=False))
 
+    if args.get_closest:
+        print(pers_dic.get_closest(args.get_closest, args.max_distance))
+
+    if args.keys_partial:
+        for k in pers_dic.get_partial_keys(args.keys_partial):
+            print(k)
+
     if args.show:
         for k, v in pers_dic.get_all().items():
             print(f'{k} -> {v}')
@@ -144,3 +591,5 @@ if __name__ == '__main__':
     if args.keys:
         for k in pers_dic.get_keys():
             print(k)
+
+    pers_dic.close()
@@ -0,0 +1,155 @@
+"""Pool of persistent dictionaries, one per namespace
+
+Each namespace (e.g., a Mattermost team) has its own PersDic, stored in its
+own file in a common directory, which is only loaded when the namespace is
+accessed for the first time. Dictionaries are pinned while in use and,
+when the total number of entries loaded exceeds a budget, those not
+pinned are closed and evicted in least-recently-used order.
+"""
+
+import os
+import re
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import Condition, Lock
+
+from persdic import PersDic
+
+SUFFIXES = {
+    'json': '.json',
+    'sqlite': '.db',
+}
+
+class PoolEntry(object):
+    """A dictionary in the pool, loaded on first use"""
+
+    def __init__(self):
+        self.pers_dic = None
+        self.pins = 0
+        # number of entries when last released
+        self.size = 0
+        self.load_lock = Lock()
+
+class PersDicPool(object):
+    def __init__(self, directory, budget=100000, storage='json', **options):
+        """Initialize an empty pool.
+
+        Parameters
+        ----------
+        directory : str
+            The directory containing the files of the dictionaries,
+            created if not existing
+
+        budget : int
+            The maximum number of entries loaded in all the dictionaries:
+            when exceeded, those not in use are evicted, except the most
+            recently used one
+
+        storage : str
+            The storage backend of the dictionaries
+
+        options : dict
+            Other options passed to the PersDic constructor
+        """
+
+        if storage not in SUFFIXES:
+            raise ValueError(f'Invalid storage: {storage}')
+
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._budget = budget
+        self._storage = storage
+        self._options = options
+        self._entries = OrderedDict()
+        # sum of the sizes of the entries
+        self._total = 0
+        self._closing = set()
+        self._lock = Lock()
+        self._closed = Condition(self._lock)
+
+    def filename(self, namespace):
+        """Return the name of the file of a namespace"""
+
+        return os.path.join(
+            self.directory,
+            re.sub(r'[^A-Za-z0-9_-]', '_', namespace) + SUFFIXES[self._storage])
+
+    def namespaces(self):
+        """Return the list of namespaces currently loaded"""
+
+        with self._lock:
+            return list(self._entries.keys())
+
+    @contextmanager
+    def acquire(self, namespace):
+        """Return the dictionary of a namespace, which is not evicted until
+        released at the end of the with block"""
+
+        with self._lock:
+            entry = self._entries.get(namespace)
+            # wait for the previous dictionary, if evicted, to be saved
+            while entry is None and namespace in self._closing:
+                self._closed.wait()
+                entry = self._entries.get(namespace)
+            if entry is None:
+                entry = PoolEntry()
+                self._entries[namespace] = entry
+            self._entries.move_to_end(namespace)
+            entry.pins += 1
+
+        try:
+            with entry.load_lock:
+                if entry.pers_dic is None:
+                    entry.pers_dic = PersDic(self.filename(namespace),
+                                             storage=self._storage,
+                                             **self._options)
+            yield entry.pers_dic
+
+        finally:
+            # the entry is pinned, hence not closed in the meanwhile
+            size = 0 if entry.pers_dic is None else len(entry.pers_dic)
+            with self._lock:
+                entry.pins -= 1
+                # unless evicted by close()
+                if self._entries.get(namespace) is entry:
+                    self._total += size - entry.size
+                    entry.size = size
+            self._evict()
+
+    def close(self):
+        """Close all the dictionaries"""
+
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+            self._total = 0
+        for entry in entries:
+            with entry.load_lock:
+                if entry.pers_dic is not None:
+                    entry.pers_dic.close()
+
+    def _evict(self):
+        """Close the least recently used dictionaries not in use, if over
+        the budget"""
+
+        victims = []
+        with self._lock:
+            if self._total <= self._budget:
+                return
+            for namespace, entry in list(self._entries.items())[:-1]:
+                if self._total <= self._budget:
+                    break
+                if entry.pins > 0 or entry.pers_dic is None:
+                    continue
+                self._total -= entry.size
+                del self._entries[namespace]
+                self._closing.add(namespace)
+                victims.append((namespace, entry))
+
+        for namespace, entry in victims:
+            try:
+                entry.pers_dic.close()
+            finally:
+                with self._lock:
+                    self._closing.discard(namespace)
+                    self._closed.notify_all()
@@ -0,0 +1,431 @@
+"""Storage backends of the persistent dictionary PersDic
+
+A storage saves the changes of the dictionary, passed as a list of records
+['add', key, value] or ['del', key], and loads the dictionary back.
+
+In-memory storages (lazy = False) return the full dictionary upon
+loading, which is then kept in memory by PersDic.
+
+Lazy storages (lazy = True) only return the keys upon loading, while the
+values are read from the storage when needed, which keeps the memory
+usage low for large dictionaries.
+"""
+
+import fcntl
+import json
+import os
+import sqlite3
+from threading import Event, Lock, Thread, local
+
+
+class JsonStorage(object):
+    """Dictionary stored in a JSON file, which is in memory.
+
+    By default the full dictionary is written to file at every change.
+
+    In journal mode, instead, every change is appended as a small record
+    to a journal file (the dictionary file name with suffix .journal), which
+    is periodically compacted in background into the dictionary file.
+    Upon loading, the journal records are replayed on top of the dictionary
+    file. A record that has not been completely written, e.g., because of a
+    crash, is discarded.
+
+    The journals belong to the storage in journal mode, which holds a lock
+    on a file (the dictionary file name with suffix .journal.lock) until
+    closed. Only the owner of the lock merges the journals into the
+    dictionary file and removes them, also when the journals are left by a
+    previous journal mode. If another process is in journal mode, the
+    storage can only be read, e.g., to show the dictionary of a running bot.
+
+    In both cases the dictionary file is written to a temporary file first,
+    which then atomically replaces the previous one.
+    """
+
+    lazy = False
+
+    def __init__(self, filename, journal=False, compact_every=1000,
+                 compact_interval=60.0, fsync=False):
+        """Initialize the storage.
+
+        Parameters
+        ----------
+        filename : str
+            The name of the file containing the dictionary
+
+        journal : bool
+            If true then append changes to a journal file instead of
+            writing the full dictionary at every change
+
+        compact_every : int
+            In journal mode, compact as soon as the journal has this
+            number of records
+
+        compact_interval : float
+            In journal mode, compact the records in the journal, if any,
+            at least every this number of seconds
+
+        fsync : bool
+            In journal mode, force the records to disk after every write
+        """
+
+        self.filename = filename
+        self._journal_name = f'{filename}.journal'
+        self._old_journal_name = f'{filename}.journal.old'
+        self._use_journal = journal
+        self._journal = None
+        self._journal_lock = None
+        self._read_only = False
+        self._records = 0
+        self._content = dict()
+        self._compact_every = compact_every
+        self._compact_interval = compact_interval
+        self._fsync = fsync
+        self._lock = Lock()
+        self._compact_lock = Lock()
+        self._compact_needed = Event()
+        self._stopped = False
+        self._compactor = None
+
+    def load(self):
+        """Return the dictionary read from file, empty if not existing"""
+
+        content = dict()
+        try:
+            with open(self.filename, 'r') as pers_file:
+                content = json.load(pers_file)
+        except FileNotFoundError:
+            pass
+
+        # a process in journal mode always has a journal
+        journals = [self._old_journal_name, self._journal_name]
+        owner = (not self._use_journal
+                 and not any(os.path.exists(x) for x in journals)
+                 ) or self._lock_journals()
+        if self._use_journal and not owner:
+            raise RuntimeError(
+                f'{self.filename} is in journal mode in another process')
+
+        # replay the records of the journals, if any, then, unless another
+        # process is still appending to them, make the dictionary file
+        # up-to-date and remove the journals
+        replayed = False
+        for journal_name in journals:
+            replayed = self._replay(journal_name, content) or replayed
+        if replayed and owner:
+            self._write_snapshot(content)
+            for journal_name in journals:
+                if os.path.exists(journal_name):
+                    os.remove(journal_name)
+
+        if not self._use_journal:
+            self._unlock_journals()
+        self._read_only = not owner
+        self._content = content
+
+        if self._use_journal and self._compactor is None:
+            self._journal = open(self._journal_name, 'a')
+            self._compactor = Thread(target=self._compact_loop, daemon=True)
+            self._compactor.start()
+
+        return content
+
+    def write(self, records, content):
+        """Save changes to file.
+
+        Parameters
+        ----------
+        records : list
+            The changes to be saved
+
+        content : dict
+            The full dictionary after the changes, which the caller may
+            change later, hence it is copied before being written
+        """
+
+        if self._read_only:
+            raise RuntimeError(
+                f'{self.filename} is in journal mode in another process')
+
+        with self._lock:
+            self._content = content
+            if self._journal is None:
+                self._write_snapshot(content)
+                return
+
+            self._journal.write(''.join(json.dumps(x) + '\n' for x in records))
+            self._journal.flush()
+            if self._fsync:
+                os.fsync(self._journal.fileno())
+            self._records += len(records)
+            if self._records >= self._compact_every:
+                self._compact_needed.set()
+
+    def compact(self):
+        """Merge the journal records into the dictionary file.
+
+        The journal is rotated while holding the lock, but the dictionary
+        file is written without it. Until the latter has been replaced
+        the rotated journal is kept, so that it can be replayed if the
+        process crashes in the meanwhile.
+        """
+
+        with self._compact_lock:
+            with self._lock:
+                if self._journal is None or self._records == 0:
+                    return
+                content = self._content
+                self._journal.close()
+                os.replace(self._journal_name, self._old_journal_name)
+                self._journal = open(self._journal_name, 'a')
+                self._records = 0
+
+            self._write_snapshot(content)
+            os.remove(self._old_journal_name)
+
+    def close(self):
+        """Stop the background compaction and compact the journal, if any.
+
+        Changes saved after closing are written to the dictionary file.
+        """
+
+        if self._compactor is None:
+            return
+        self._stopped = True
+        self._compact_needed.set()
+        self._compactor.join()
+        self._compactor = None
+        self.compact()
+        with self._lock:
+            self._journal.close()
+            self._journal = None
+            self._unlock_journals()
+
+    def _lock_journals(self):
+        """Take the lock of the journals, if not yet, return False if it is
+        held by another process"""
+
+        if self._journal_lock is not None:
+            return True
+        fd = os.open(f'{self._journal_name}.lock', os.O_RDWR | os.O_CREAT,
+                     0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._journal_lock = fd
+        return True
+
+    def _unlock_journals(self):
+        """Release the lock of the journals, if held"""
+
+        if self._journal_lock is not None:
+            os.close(self._journal_lock)
+            self._journal_lock = None
+
+    def _write_snapshot(self, content):
+        """Atomically replace the dictionary file with the given content"""
+
+        # copying a dict is atomic, unlike serializing it
+        content = dict(content)
+        tmp_name = f'{self.filename}.tmp'
+        with open(tmp_name, 'w') as pers_file:
+            json.dump(content, pers_file)
+            pers_file.flush()
+            os.fsync(pers_file.fileno())
+        os.replace(tmp_name, self.filename)
+
+    def _replay(self, journal_name, content):
+        """Apply the records of a journal to content, return True if it exists.
+
+        Replaying stops at the first record that is incomplete or corrupted.
+        """
+
+        try:
+            with open(journal_name, 'r') as journal_file:
+                for line in journal_file:
+                    if not line.endswith('\n'):
+                        break
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break
+                    if record[0] == 'add':
+                        content[record[1]] = record[2]
+                    elif record[0] == 'del':
+                        content.pop(record[1], None)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _compact_loop(self):
+        """Compact the journal when needed until closed"""
+
+        while not self._stopped:
+            self._compact_needed.wait(timeout=self._compact_interval)
+            self._compact_needed.clear()
+            if not self._stopped:
+                self.compact()
+
+
+class SqliteStorage(object):
+    """Dictionary stored in an SQLite database, which is read lazily.
+
+    The entries are stored in a table whose primary key is the dictionary
+    key, hence single values are read from disk through the index of the
+    table. The database is used in WAL mode, with one connection per
+    thread, so that reads do not block one another nor the writes.
+    """
+
+    lazy = True
+
+    def __init__(self, filename, fsync=False):
+        """Initialize the storage.
+
+        Parameters
+        ----------
+        filename : str
+            The name of the SQLite database file
+
+        fsync : bool
+            If true then force every write to disk, otherwise only
+            at checkpoints of the write-ahead log
+        """
+
+        self.filename = filename
+        self._fsync = fsync
+        self._local = local()
+        self._connections = []
+        self._connections_lock = Lock()
+        self._lock = Lock()
+
+        conn = self._connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS persdic (key TEXT PRIMARY KEY, value TEXT)')
+        conn.commit()
+
+    def keys(self):
+        """Return the list of keys"""
+
+        return [x[0] for x in self._connection().execute(
+            'SELECT key FROM persdic')]
+
+    def get(self, key):
+        """Return the value of a key, None if not found"""
+
+        row = self._connection().execute(
+            'SELECT value FROM persdic WHERE key = ?', (key,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def items(self):
+        """Return an iterator over all the (key, value) pairs"""
+
+        for key, value in self._connection().execute(
+                'SELECT key, value FROM persdic'):
+            yield key, json.loads(value)
+
+    def write(self, records, content=None):
+        """Save changes in a single transaction.
+
+        Parameters
+        ----------
+        records : list
+            The changes to be saved
+
+        content : dict
+            Unused
+        """
+
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                for record in records:
+                    if record[0] == 'add':
+                        conn.execute(
+                            'INSERT OR REPLACE INTO persdic (key, value) VALUES (?, ?)',
+                            (record[1], json.dumps(record[2])))
+                    elif record[0] == 'del':
+                        conn.execute('DELETE FROM persdic WHERE key = ?',
+                                     (record[1],))
+
+    def close(self):
+        """Close the connections of all the threads"""
+
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+            self._local = local()
+
+    def _connection(self):
+        """Return the connection of the calling thread"""
+
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # only used by this thread, but closed by close()
+            conn = sqlite3.connect(self.filename, check_same_thread=False)
+            conn.execute(
+                f'PRAGMA synchronous={"FULL" if self._fsync else "NORMAL"}')
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+
+STORAGES = {
+    'json': JsonStorage,
+    'sqlite': SqliteStorage,
+}
+
+
+def make_storage(storage, filename, **options):
+    """Return a new storage.
+
+    Parameters
+    ----------
+    storage : str
+        The type of storage, one of STORAGES
+
+    filename : str
+        The name of the file containing the dictionary
+
+    options : dict
+        Options passed to the storage constructor
+    """
+
+    if storage not in STORAGES:
+        raise ValueError(f'Invalid storage: {storage}')
+    return STORAGES[storage](filename, **options)
+
+
+def migrate(source, destination):
+    """Copy all the entries of a storage into another one.
+
+    Entries already in the destination are overwritten by those in the
+    source with the same key, the other ones are kept. Both storages are
+    closed at the end.
+
+    Parameters
+    ----------
+    source : storage
+        The storage to read from
+
+    destination : storage
+        The storage to write to
+
+    Returns
+    -------
+    the number of entries copied
+    """
+
+    entries = dict(source.items()) if source.lazy else source.load()
+    content = None
+    if not destination.lazy:
+        content = destination.load()
+        content.update(entries)
+    destination.write([['add', k, v] for k, v in entries.items()], content)
+
+    source.close()
+    destination.close()
+    return len(entries)
@@ -0,0 +1,140 @@
+"""
+Opt-in profiling of long-running bots.
+
+A Profiler, once enabled, runs a random sample of the requests under
+cProfile, saving the statistics of each in a .prof file, which can be
+analysed offline, e.g., with pstats or snakeviz. Only one request at a time
+is profiled, the others are executed as usual.
+
+On demand, the Profiler also takes tracemalloc snapshots of the memory
+allocated: the first one starts tracing, every following one is saved in a
+.snapshot file, to be loaded with tracemalloc.Snapshot.load(), together
+with a .txt file reporting the lines of code that allocated most memory
+since the previous snapshot.
+
+Profiling and tracing are off until requested, via the signals or admin
+routes set up by slashserver.py, and the requests are not affected at all
+if no Profiler is used.
+"""
+
+import cProfile
+import itertools
+import os
+import random
+import time
+import tracemalloc
+from threading import Lock
+
+DEFAULT_RATE = 0.01
+TRACE_FRAMES = 10
+TOP_STATS = 50
+
+
+class Profiler(object):
+    def __init__(self, directory, rate=DEFAULT_RATE):
+        """Initialize the profiler, with sampling and tracing off.
+
+        Parameters
+        ---------
+        directory : str
+            The directory where to save the output files, created if
+            not existing
+
+        rate : float
+            The fraction of requests profiled when sampling
+        """
+
+        if not 0 < rate <= 1:
+            raise ValueError(f"Invalid profiling rate: {rate}")
+
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.rate = rate
+        self.sampling = False
+        self._profile_lock = Lock()
+        self._memory_lock = Lock()
+        self._snapshot = None
+        self._counter = itertools.count()
+
+    def call(self, func, *args):
+        """Return func(*args), profiled if sampled"""
+
+        if (
+            not self.sampling
+            or random.random() >= self.rate
+            or not self._profile_lock.acquire(blocking=False)
+        ):
+            return func(*args)
+
+        try:
+            profile = cProfile.Profile()
+            try:
+                return profile.runcall(func, *args)
+            finally:
+                profile.dump_stats(self._filename("profile", "prof"))
+        finally:
+            self._profile_lock.release()
+
+    def start_sampling(self):
+        """Start profiling a sample of the requests, return a message"""
+
+        self.sampling = True
+        return f"Profiling {self.rate:.1%} of the requests in {self.directory}"
+
+    def stop_sampling(self):
+        """Stop profiling the requests, return a message"""
+
+        self.sampling = False
+        return "Profiling stopped"
+
+    def toggle_sampling(self):
+        """Start or stop profiling the requests, return a message"""
+
+        return self.stop_sampling() if self.sampling else self.start_sampling()
+
+    def take_snapshot(self):
+        """Start tracing the memory allocations, if not yet, otherwise save
+        a snapshot and its difference from the previous one, return a message"""
+
+        with self._memory_lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(TRACE_FRAMES)
+                self._snapshot = None
+
+            snapshot = tracemalloc.take_snapshot().filter_traces(
+                (tracemalloc.Filter(False, tracemalloc.__file__),)
+            )
+            previous = self._snapshot
+            self._snapshot = snapshot
+            if previous is None:
+                return "Memory tracing started, take another snapshot for a diff"
+
+            filename = self._filename("memory", "snapshot")
+            snapshot.dump(filename)
+            report = os.path.splitext(filename)[0] + ".txt"
+            current, peak = tracemalloc.get_traced_memory()
+            with open(report, "w") as outfile:
+                outfile.write(
+                    f"Traced memory: {current} B, peak {peak} B\n"
+                    f"Top {TOP_STATS} differences since the previous snapshot:\n"
+                )
+                for stat in snapshot.compare_to(previous, "lineno")[:TOP_STATS]:
+                    outfile.write(f"{stat}\n")
+            return f"Memory snapshot saved in {filename}, diff in {report}"
+
+    def stop_tracing(self):
+        """Stop tracing the memory allocations, return a message"""
+
+        with self._memory_lock:
+            tracemalloc.stop()
+            self._snapshot = None
+        return "Memory tracing stopped"
+
+    def _filename(self, kind, extension):
+        """Return the name of a new output file"""
+
+        return os.path.join(
+            self.directory,
+            f"{kind}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-"
+            f"{next(self._counter)}.{extension}",
+        )
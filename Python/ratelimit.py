@@ -0,0 +1,161 @@
+"""
+Rate limiting of the queries to remote APIs.
+
+A TokenBucket allows on average `rate` queries per second, with bursts of
+at most `burst` queries, and it can be shared by multiple threads.
+An AdaptiveTokenBucket, instead, looks for the highest rate accepted by
+the remote API: the rate is increased a little after every successful
+query and halved every time a query is throttled.
+
+retry() calls a function until it succeeds, waiting with exponential
+backoff (and some jitter) every time it fails because of throttling.
+"""
+
+import random
+import time
+from threading import Lock
+
+DEFAULT_RETRIES = 5
+DEFAULT_BACKOFF = 1.0
+MAX_BACKOFF = 60.0
+
+
+class TokenBucket(object):
+    def __init__(self, rate, burst=1):
+        """Initialize a full bucket.
+
+        Parameters
+        ---------
+        rate : float
+            Number of tokens added per second
+
+        burst : int
+            Maximum number of tokens in the bucket
+        """
+
+        if rate <= 0:
+            raise ValueError(f"Invalid rate: {rate}")
+        if burst < 1:
+            raise ValueError(f"Invalid burst: {burst}")
+
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = Lock()
+
+    def acquire(self):
+        """Take a token from the bucket, waiting until one is available"""
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.burst, self._tokens + (now - self._last) * self.rate
+                )
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def succeeded(self):
+        """Notify that a query has succeeded"""
+
+        pass
+
+    def throttled(self):
+        """Notify that a query has been throttled"""
+
+        pass
+
+
+class AdaptiveTokenBucket(TokenBucket):
+    def __init__(self, rate, burst=1, min_rate=None, max_rate=None, increase=None):
+        """Initialize a full bucket.
+
+        Parameters
+        ---------
+        rate : float
+            Initial number of tokens added per second
+
+        burst : int
+            Maximum number of tokens in the bucket
+
+        min_rate : float
+            Minimum rate, by default 1/16 of the initial rate
+
+        max_rate : float
+            Maximum rate, by default 4 times the initial rate
+
+        increase : float
+            Rate increase after every successful query, by default 1/10
+            of the initial rate
+        """
+
+        super().__init__(rate, burst)
+        self.min_rate = rate / 16 if min_rate is None else min_rate
+        self.max_rate = rate * 4 if max_rate is None else max_rate
+        self.increase = rate / 10 if increase is None else increase
+
+    def succeeded(self):
+        """Increase the rate additively"""
+
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def throttled(self):
+        """Halve the rate and empty the bucket"""
+
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = 0.0
+
+
+def retry(
+    func,
+    errors,
+    retries=DEFAULT_RETRIES,
+    backoff=DEFAULT_BACKOFF,
+    limiter=None,
+):
+    """Return the result of func(), called again upon throttling.
+
+    Parameters
+    ---------
+    func : callable
+        The function to call, without arguments
+
+    errors : tuple
+        The exceptions raised by func when throttled
+
+    retries : int
+        The maximum number of times func is called again, after which
+        the last exception is raised
+
+    backoff : float
+        The time, in seconds, to wait before calling func the second time,
+        doubled at every further attempt
+
+    limiter : TokenBucket
+        If not None, a token is taken from it before every call, and it
+        is notified of the outcome of the call
+    """
+
+    delay = backoff
+    for attempt in range(retries + 1):
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            result = func()
+            if limiter is not None:
+                limiter.succeeded()
+            return result
+        except errors:
+            if limiter is not None:
+                limiter.throttled()
+            if attempt == retries:
+                raise
+        time.sleep(delay * random.uniform(0.5, 1.5))
+        delay = min(MAX_BACKOFF, delay * 2)
@@ -0,0 +1,1098 @@
+"""
+HTTP server shared by the Mattermost slash command bots.
+
+Each bot only provides a handler function that takes the text of the
+slash command and returns the pair [response, private]: the server takes
+care of parsing the POST, dispatching it to the handler of the command
+after checking its token, and sending back the JSON response to the
+Mattermost server. Multiple commands can be served on the same port.
+
+Two serving modes are available:
+
+- threaded: one HTTPServer whose connections are handled in a bounded
+  pool of worker threads
+- asyncio: connections are handled by an asyncio event loop, while the
+  (blocking) command handlers run in a bounded pool of worker threads
+
+In both cases a slow command only occupies one worker, hence it does not
+block the other requests in flight. Moreover, if a command limit is set,
+the requests of every command are admitted separately: at most that number
+are executed concurrently, and a bounded number wait, for a bounded time,
+for one of them to finish, while the others are answered immediately that
+the command is busy, so that a burst of requests to a slow command cannot
+take all the workers.
+
+Since the commands share the GIL, CPU-bound commands can be served by
+multiple worker processes, forked by a supervisor which restarts them if
+they exit. All the workers accept connections on the same port, via
+SO_REUSEPORT, and each creates its own slash commands, thus those sharing
+files must be able to do so, see the shared mode of PersDic.
+
+Instead of logging every request, the server records the number of
+requests by command and status, their latency, and the number of those
+in flight, which can be served on an admin port, see metrics.py.
+
+With a profiling directory, a sample of the requests can be profiled and
+snapshots of the memory allocations taken, see profiling.py, which is
+requested with the signals SIGUSR1 (to start or stop profiling) and SIGUSR2
+(to take a memory snapshot) or via the admin routes.
+"""
+
+import asyncio
+import json
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition, Lock, Thread, Timer
+from http import HTTPStatus
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+import metrics
+from mattermostrequest import MalformedRequest, parse
+from profiling import DEFAULT_RATE, Profiler
+
+MODES = ["threaded", "asyncio"]
+DEFAULT_WORKERS = 8
+# no limit: the requests of all the commands are admitted
+DEFAULT_COMMAND_LIMIT = 0
+DEFAULT_COMMAND_QUEUE = 2
+DEFAULT_QUEUE_TIMEOUT = 1.0
+MAX_BODY = 64 * 1024
+DEFAULT_IDLE_TIMEOUT = 30.0
+DEFAULT_MAX_CONNECTIONS = 256
+# connections waiting to be accepted
+LISTEN_BACKLOG = 128
+# minimum time, in seconds, a connection must be idle to be closed early,
+# unless all the threads are held by idle connections
+IDLE_GRACE = 0.5
+# minimum time, in seconds, between the start and restart of a worker process
+RESTART_DELAY = 1.0
+
+# label of the requests rejected before knowing their (valid) command
+UNKNOWN = "unknown"
+# response to the requests of a command not admitted, after its name
+BUSY_TEXT = "is busy, please try again later"
+
+REQUESTS = metrics.counter(
+    "mmbots_requests_total", "Requests served.", ("command", "status")
+)
+REQUEST_SECONDS = metrics.histogram(
+    "mmbots_request_seconds", "Time to execute the commands.", ("command",)
+)
+IN_FLIGHT = metrics.gauge(
+    "mmbots_requests_in_flight", "Commands being executed."
+)
+CONNECTIONS = metrics.gauge("mmbots_connections_open", "Connections open.")
+QUEUED = metrics.counter(
+    "mmbots_requests_queued_total",
+    "Requests that waited for their command to be available.",
+    ("command",),
+)
+WAITING = metrics.gauge(
+    "mmbots_requests_waiting",
+    "Requests waiting for their command to be available.",
+    ("command",),
+)
+SHED = metrics.counter(
+    "mmbots_requests_shed_total",
+    "Requests answered that their command is busy.",
+    ("command", "reason"),
+)
+
+
+class RequestError(Exception):
+    """Error in a request, which is answered with an HTTP status code"""
+
+    def __init__(self, status, text):
+        super().__init__(text)
+        self.status = status
+
+    def response(self):
+        """Return the HTTP status code and the data to be sent back"""
+
+        return self.status, {"text": str(self)}
+
+
+def content_length(header):
+    """Return the length of the body of a POST from its Content-Length header
+
+    Raises
+    ------
+    RequestError
+        If the header is missing or invalid, or the body is larger than MAX_BODY
+    """
+
+    try:
+        length = int(header)
+    except (TypeError, ValueError):
+        raise RequestError(411, "missing or invalid Content-Length") from None
+    if length < 0:
+        raise RequestError(400, "invalid Content-Length")
+    if length > MAX_BODY:
+        raise RequestError(413, "request too large")
+    return length
+
+
+def response_data(responsetext):
+    """Return the data to be sent to Mattermost from the pair [response, private]"""
+
+    return {
+        "response_type": "ephemeral" if responsetext[1] else "in_channel",
+        "text": responsetext[0],
+    }
+
+
+class SlashCommand(object):
+    """A slash command served by a bot"""
+
+    def __init__(self, command, token, handler, close=None, pass_request=False):
+        """Initialize the slash command.
+
+        Parameters
+        ---------
+        command : str
+            The command to match, e.g., '/meme'
+
+        token : str
+            The token to match
+
+        handler : callable
+            Function called with the text of the command, which returns
+            the response to be sent and whether it should be private
+
+        close : callable
+            If not None, function called when the server stops
+
+        pass_request : bool
+            If true then the handler is also passed the MattermostRequest
+        """
+
+        self.command = command
+        self.token = token
+        self.handler = handler
+        self.close = close
+        self.pass_request = pass_request
+
+    def respond(self, request):
+        """Return the HTTP status code and the data to be sent back
+
+        Parameters
+        ---------
+        request : MattermostRequest
+            The request received from the Mattermost server, whose command
+            and token have been already checked
+        """
+
+        text = request.text or "help"
+
+        if self.pass_request:
+            responsetext = self.handler(text, request)
+        else:
+            responsetext = self.handler(text)
+
+        return 200, response_data(responsetext)
+
+
+class Admission(object):
+    """Admission of the requests of a command, at most limit of which are
+    executed concurrently, while at most depth others wait, in order, for
+    at most timeout seconds"""
+
+    def __init__(self, command, limit, depth, timeout):
+        self.command = command
+        self.limit = limit
+        self.depth = depth
+        self.timeout = timeout
+        self._condition = Condition()
+        self._running = 0
+        # requests waiting, and those whose turn has come
+        self._waiting = 0
+        self._granted = 0
+
+    def acquire(self):
+        """Return None if a request can be executed, in which case release()
+        must be called when it finishes, otherwise the reason why it is not:
+        'queue_full' or 'timeout'"""
+
+        with self._condition:
+            if self._running < self.limit:
+                self._running += 1
+                return None
+            if self._waiting >= self.depth:
+                return "queue_full"
+
+            self._waiting += 1
+            QUEUED.inc(self.command)
+            WAITING.inc(self.command)
+            try:
+                deadline = time.monotonic() + self.timeout
+                while self._granted == 0:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._waiting -= 1
+                        return "timeout"
+                    self._condition.wait(remaining)
+                self._granted -= 1
+                return None
+            finally:
+                WAITING.dec(self.command)
+
+    def release(self):
+        """Pass the turn to the first request waiting, if any"""
+
+        with self._condition:
+            if self._waiting > 0:
+                self._waiting -= 1
+                self._granted += 1
+                self._condition.notify()
+            else:
+                self._running -= 1
+
+
+class Dispatcher(object):
+    """Dispatch table from the command names to the slash commands served"""
+
+    def __init__(
+        self,
+        slash_commands,
+        profiler=None,
+        command_limit=DEFAULT_COMMAND_LIMIT,
+        command_queue=DEFAULT_COMMAND_QUEUE,
+        queue_timeout=DEFAULT_QUEUE_TIMEOUT,
+    ):
+        """Initialize the dispatch table.
+
+        Parameters
+        ---------
+        slash_commands : list
+            The SlashCommand objects to be served, with distinct commands
+
+        profiler : Profiler
+            If not None, the commands are executed via the profiler
+
+        command_limit : int
+            Maximum number of requests of every command executed
+            concurrently, 0 to admit all of them
+
+        command_queue : int
+            Maximum number of requests of every command waiting to be executed
+
+        queue_timeout : float
+            Maximum time, in seconds, a request waits to be executed
+        """
+
+        self.profiler = profiler
+        self._table = dict()
+        self._admissions = dict()
+        for slash_command in slash_commands:
+            command = slash_command.command
+            if command in self._table:
+                raise ValueError(f"Duplicate command: {command}")
+            self._table[command] = slash_command
+            if command_limit > 0:
+                self._admissions[command] = Admission(
+                    command, command_limit, command_queue, queue_timeout
+                )
+
+    def commands(self):
+        """Return the list of commands served"""
+
+        return list(self._table.keys())
+
+    def respond(self, body):
+        """Return the HTTP status code and the data to be sent back
+
+        Parameters
+        ---------
+        body : bytes
+            The body of the POST received from the Mattermost server
+        """
+
+        try:
+            request = parse(body.decode("utf-8"))
+        except (UnicodeDecodeError, MalformedRequest):
+            REQUESTS.inc(UNKNOWN, 400)
+            return 400, {"text": "malformed request"}
+
+        slash_command = self._table.get(request.command)
+        if slash_command is None or request.token != slash_command.token:
+            REQUESTS.inc(UNKNOWN, 401)
+            return 401, {"text": "invalid request"}
+
+        admission = self._admissions.get(request.command)
+        reason = None if admission is None else admission.acquire()
+        if reason is not None:
+            SHED.inc(request.command, reason)
+            REQUESTS.inc(request.command, 200)
+            return 200, response_data(
+                [f"{request.command} {BUSY_TEXT}", True]
+            )
+
+        IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            if self.profiler is None:
+                status, data = slash_command.respond(request)
+            else:
+                status, data = self.profiler.call(slash_command.respond, request)
+            return status, data
+        except Exception:
+            # a handler raising an exception is an internal error, still
+            # answered so that the connection can be used again
+            traceback.print_exc()
+            status = 500
+            return status, {"text": "internal error"}
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - start, request.command)
+            IN_FLIGHT.dec()
+            if admission is not None:
+                admission.release()
+            REQUESTS.inc(request.command, status)
+
+
+def http_response(status, data, keep_alive):
+    """Return the bytes of an HTTP/1.1 response with JSON data"""
+
+    payload = json.dumps(data).encode("utf-8")
+    return (
+        f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+        "Content-type: application/json\r\n"
+        f"Content-Length: {len(payload)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+        "\r\n"
+    ).encode("iso-8859-1") + payload
+
+
+class PostHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # the headers and the body are written separately
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        # idle connections, or requests too slow to arrive, time out
+        self.timeout = self.server.idle_timeout or None
+        super().setup()
+
+    def handle(self):
+        """Handle the requests of a connection until it is closed"""
+
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection and self.server.wait_request(
+            self.connection
+        ):
+            self.handle_one_request()
+        self.server.busy(self.connection)
+
+    def do_POST(self):
+        """Respond to a POST request."""
+
+        self.server.busy(self.connection)
+
+        # Extract the contents of the POST, unless too large
+        try:
+            length = content_length(self.headers["Content-Length"])
+        except RequestError as err:
+            status, data = err.response()
+            REQUESTS.inc(UNKNOWN, status)
+            # the body has not been read
+            keep_alive = False
+        else:
+            body = self.rfile.read(length)
+            status, data = self.server.dispatcher.respond(body)
+            keep_alive = self.server.keep_alive()
+
+        payload = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        if not keep_alive:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_request(self, code="-", size="-"):
+        """Do not log the requests, which are counted in the metrics"""
+
+        pass
+
+    def log_error(self, format, *args):
+        """Log errors, except idle connections timing out"""
+
+        if not format.startswith("Request timed out"):
+            super().log_error(format, *args)
+
+
+class PoolHTTPServer(HTTPServer):
+    """HTTPServer handling the connections in a bounded pool of threads.
+
+    Since a connection occupies a thread until closed, even if idle, when
+    there are more connections than threads those served are closed after
+    their current request, and those idle for some time are closed.
+    """
+
+    request_queue_size = LISTEN_BACKLOG
+
+    def __init__(
+        self,
+        address,
+        dispatcher,
+        workers,
+        reuse_port=False,
+        idle_timeout=DEFAULT_IDLE_TIMEOUT,
+        max_connections=DEFAULT_MAX_CONNECTIONS,
+    ):
+        self.reuse_port = reuse_port
+        super().__init__(address, PostHandler)
+        self.dispatcher = dispatcher
+        self.workers = workers
+        self.idle_timeout = idle_timeout
+        self.max_connections = max_connections
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="slashserver"
+        )
+        self._lock = Lock()
+        self._connections = 0
+        # idle connections, with the time since when they are idle
+        self._idle = dict()
+        self._timer = None
+        self._stopping = False
+
+    def server_bind(self):
+        if self.reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+    def process_request(self, request, client_address):
+        with self._lock:
+            rejected = self._connections >= self.max_connections
+            if not rejected:
+                self._connections += 1
+
+        if rejected:
+            REQUESTS.inc(UNKNOWN, 503)
+            try:
+                request.sendall(
+                    http_response(503, {"text": "too many connections"}, False)
+                )
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+
+        CONNECTIONS.inc()
+        self._executor.submit(self._process_request_worker, request, client_address)
+        self._make_room()
+
+    def _process_request_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            with self._lock:
+                self._connections -= 1
+            CONNECTIONS.dec()
+
+    def keep_alive(self):
+        """Return True if the connection can be kept open after a request"""
+
+        with self._lock:
+            return (
+                self.idle_timeout > 0
+                and not self._stopping
+                and self._connections <= self.workers
+            )
+
+    def wait_request(self, connection):
+        """Mark a connection as idle until busy() is called, return False
+        if it should be closed instead"""
+
+        with self._lock:
+            if self._stopping:
+                return False
+            self._idle[connection] = time.monotonic()
+            return True
+
+    def busy(self, connection):
+        """Mark a connection as no longer idle"""
+
+        with self._lock:
+            self._idle.pop(connection, None)
+
+    def _make_room(self, timer=False):
+        """If there are more connections than threads, close the connection
+        idle for the longest time, so that its thread is released: right
+        away if all the threads are held by idle connections, since none
+        is released by a request finishing, otherwise if idle for at least
+        IDLE_GRACE seconds, checking again later if not yet"""
+
+        with self._lock:
+            if timer:
+                self._timer = None
+            if self._connections <= self.workers or not self._idle:
+                return
+            connection, since = min(self._idle.items(), key=lambda x: x[1])
+            wait = since + IDLE_GRACE - time.monotonic()
+            if wait <= 0 or len(self._idle) >= self.workers:
+                self._close_idle(connection)
+                return
+            if self._timer is None:
+                self._timer = Timer(wait, self._make_room, (True,))
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _close_idle(self, connection):
+        """Close an idle connection, whose handler then returns"""
+
+        assert self._lock.locked()
+        del self._idle[connection]
+        try:
+            connection.shutdown(socket.SHUT_RD)
+        except OSError:
+            pass
+
+    def server_close(self):
+        """Stop accepting connections, close the idle ones, and wait for
+        those in flight"""
+
+        super().server_close()
+        with self._lock:
+            self._stopping = True
+            for connection in list(self._idle):
+                self._close_idle(connection)
+        self._executor.shutdown(wait=True)
+
+
+class AsyncSlashServer(object):
+    """Minimal HTTP/1.1 server running on an asyncio event loop"""
+
+    def __init__(
+        self,
+        address,
+        dispatcher,
+        workers,
+        reuse_port=False,
+        idle_timeout=DEFAULT_IDLE_TIMEOUT,
+        max_connections=DEFAULT_MAX_CONNECTIONS,
+    ):
+        self.address = address
+        self.dispatcher = dispatcher
+        self.reuse_port = reuse_port
+        self.idle_timeout = idle_timeout
+        self.max_connections = max_connections
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="slashserver"
+        )
+        self._connections = set()
+        self._idle = set()
+        self._stopping = False
+
+    async def _read_head(self, reader, request_line):
+        """Return the method, the HTTP version, and the headers of a request"""
+
+        headers = dict()
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("iso-8859-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        fields = request_line.decode("iso-8859-1").split()
+        method = fields[0] if fields else ""
+        version = fields[-1] if len(fields) == 3 else "HTTP/1.0"
+        return method, version, headers
+
+    async def _handle_connection(self, reader, writer):
+        task = asyncio.current_task()
+        if len(self._connections) >= self.max_connections:
+            REQUESTS.inc(UNKNOWN, 503)
+            writer.write(http_response(503, {"text": "too many connections"}, False))
+            writer.close()
+            return
+
+        self._connections.add(task)
+        CONNECTIONS.inc()
+        timeout = self.idle_timeout or None
+        try:
+            keep_alive = True
+            while keep_alive and not self._stopping:
+                self._idle.add(task)
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), timeout)
+                except asyncio.CancelledError:
+                    # closed while idle, on shutdown
+                    break
+                finally:
+                    self._idle.discard(task)
+                if not request_line:
+                    break
+
+                method, version, headers = await asyncio.wait_for(
+                    self._read_head(reader, request_line), timeout
+                )
+                connection = headers.get("connection", "").lower()
+                keep_alive = self.idle_timeout > 0 and (
+                    connection == "keep-alive"
+                    or (version == "HTTP/1.1" and connection != "close")
+                )
+                try:
+                    if method != "POST":
+                        raise RequestError(501, "unsupported method")
+                    length = content_length(headers.get("content-length"))
+                    body = await asyncio.wait_for(reader.readexactly(length), timeout)
+                    status, data = await asyncio.get_running_loop().run_in_executor(
+                        self._executor, self.dispatcher.respond, body
+                    )
+                except RequestError as err:
+                    status, data = err.response()
+                    REQUESTS.inc(UNKNOWN, status)
+                    # the body has not been read
+                    keep_alive = False
+
+                keep_alive = keep_alive and not self._stopping
+                writer.write(http_response(status, data, keep_alive))
+                await writer.drain()
+
+        except (
+            asyncio.TimeoutError,
+            asyncio.IncompleteReadError,
+            ConnectionError,
+            ValueError,
+        ):
+            pass
+
+        finally:
+            writer.close()
+            self._connections.discard(task)
+            CONNECTIONS.dec()
+
+    async def serve(self):
+        """Serve until SIGINT or SIGTERM, then close the idle connections and
+        wait for the requests in flight"""
+
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set)
+
+        server = await asyncio.start_server(
+            self._handle_connection,
+            self.address[0],
+            self.address[1],
+            reuse_port=self.reuse_port,
+            backlog=LISTEN_BACKLOG,
+        )
+        async with server:
+            await stop.wait()
+        self._stopping = True
+        for task in self._idle:
+            task.cancel()
+        if self._connections:
+            await asyncio.wait(self._connections)
+        self._executor.shutdown(wait=True)
+
+
+# keyword arguments of serve() set from the command line, with their defaults
+OPTIONS = dict(
+    mode="threaded",
+    workers=DEFAULT_WORKERS,
+    processes=1,
+    command_limit=DEFAULT_COMMAND_LIMIT,
+    command_queue=DEFAULT_COMMAND_QUEUE,
+    queue_timeout=DEFAULT_QUEUE_TIMEOUT,
+    idle_timeout=DEFAULT_IDLE_TIMEOUT,
+    max_connections=DEFAULT_MAX_CONNECTIONS,
+    metrics_port=0,
+    profile_dir="",
+    profile_rate=DEFAULT_RATE,
+    admin_token="",
+)
+
+
+def add_arguments(parser, overrides=False):
+    """Add to an argparse parser the command-line options of the server
+
+    If overrides is true then the options have no default, as they override
+    those in a configuration, see options().
+    """
+
+    def add(name, help, **kwargs):
+        parser.add_argument(
+            f"--{name}",
+            default=None if overrides else OPTIONS[name],
+            help=help[:-1] + ", overrides config." if overrides else help,
+            **kwargs,
+        )
+
+    add("mode", "Serving mode.", type=str, choices=MODES)
+    add(
+        "workers",
+        "Maximum number of requests served concurrently, per process.",
+        type=int,
+    )
+    add("processes", "Number of worker processes.", type=int)
+    add(
+        "command_limit",
+        "Maximum number of requests of the same command executed "
+        "concurrently, per process, 0 for no limit.",
+        type=int,
+    )
+    add(
+        "command_queue",
+        "Maximum number of requests of the same command waiting to be "
+        "executed, per process, beyond which they are answered as busy.",
+        type=int,
+    )
+    add(
+        "queue_timeout",
+        "Maximum time, in seconds, a request waits to be executed before "
+        "being answered as busy.",
+        type=float,
+    )
+    add(
+        "idle_timeout",
+        "Time, in seconds, after which idle connections are closed, "
+        "0 to close them after every request.",
+        type=float,
+    )
+    add(
+        "max_connections",
+        "Maximum number of connections open, per process.",
+        type=int,
+    )
+    add(
+        "metrics_port",
+        "Port where to serve the metrics at /metrics, 0 to disable.",
+        type=int,
+    )
+    add(
+        "profile_dir",
+        "Directory where to save profiles and memory snapshots, "
+        "empty to disable profiling.",
+        type=str,
+    )
+    add(
+        "profile_rate",
+        "Fraction of the requests profiled, once started.",
+        type=float,
+    )
+    add(
+        "admin_token",
+        "Token needed to POST to the admin routes, empty to disable them.",
+        type=str,
+    )
+
+
+def options(args, config=None):
+    """Return the keyword arguments of serve() from the parsed command-line
+    options, taken from the configuration dictionary, if any, when None"""
+
+    config = config or dict()
+    result = dict()
+    for name, default in OPTIONS.items():
+        value = getattr(args, name)
+        result[name] = config.get(name, default) if value is None else value
+    return result
+
+
+def handle_profiling_signals(profiler):
+    """Start or stop profiling upon SIGUSR1 and take a memory snapshot upon
+    SIGUSR2, in a background thread, printing the outcome"""
+
+    def run(func):
+        Thread(target=lambda: print(func(), flush=True), daemon=True).start()
+
+    signal.signal(signal.SIGUSR1, lambda *_: run(profiler.toggle_sampling))
+    signal.signal(signal.SIGUSR2, lambda *_: run(profiler.take_snapshot))
+
+
+def supervise(processes, target, forward=()):
+    """Run target(index) in the given number of forked worker processes,
+    each with its own index, until SIGINT or SIGTERM, which are forwarded
+    to the workers as SIGTERM. Workers exiting before are restarted.
+
+    Parameters
+    ---------
+    processes : int
+        Number of worker processes
+
+    target : callable
+        Function executed by the worker processes
+
+    forward : tuple
+        Other signals forwarded to the workers
+    """
+
+    children = dict()
+    stopping = False
+
+    def start(index):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                signal.signal(signal.SIGINT, signal.default_int_handler)
+                for signum in (signal.SIGTERM,) + tuple(forward):
+                    signal.signal(signum, signal.SIG_DFL)
+                target(index)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        children[pid] = (index, time.monotonic())
+        print(f"Started worker process {index} with PID {pid}", flush=True)
+
+    def send(signum):
+        for pid in list(children):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def stop(*_):
+        nonlocal stopping
+        stopping = True
+        send(signal.SIGTERM)
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    for signum in forward:
+        signal.signal(signum, lambda signum, _: send(signum))
+
+    for index in range(processes):
+        start(index)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index, started = children.pop(pid)
+        if stopping:
+            continue
+        print(
+            f"Worker process {index} with PID {pid} exited with code "
+            f"{os.waitstatus_to_exitcode(status)}, restarting",
+            flush=True,
+        )
+        time.sleep(max(0.0, started + RESTART_DELAY - time.monotonic()))
+        if not stopping:
+            start(index)
+
+
+def serve(
+    host,
+    port,
+    slash_commands,
+    mode="threaded",
+    workers=DEFAULT_WORKERS,
+    processes=1,
+    command_limit=DEFAULT_COMMAND_LIMIT,
+    command_queue=DEFAULT_COMMAND_QUEUE,
+    queue_timeout=DEFAULT_QUEUE_TIMEOUT,
+    idle_timeout=DEFAULT_IDLE_TIMEOUT,
+    max_connections=DEFAULT_MAX_CONNECTIONS,
+    metrics_port=0,
+    profile_dir="",
+    profile_rate=DEFAULT_RATE,
+    admin_token="",
+):
+    """Serve slash commands until interrupted with SIGINT or SIGTERM
+
+    Parameters
+    ---------
+    host : str
+        Host to bind
+
+    port : int
+        Port to bind
+
+    slash_commands : list or callable
+        The SlashCommand objects to be served on the same port, or a
+        function returning them, which is required with multiple processes
+        since it is called by every worker process
+
+    mode : str
+        One of MODES
+
+    workers : int
+        Maximum number of requests served concurrently, per process
+
+    processes : int
+        Number of worker processes, if more than one
+
+    command_limit : int
+        Maximum number of requests of the same command executed
+        concurrently, per process, 0 for no limit: to keep the other
+        commands responsive when a command is overloaded, command_limit
+        plus command_queue should be less than workers
+
+    command_queue : int
+        Maximum number of requests of the same command waiting to be
+        executed, per process, beyond which they are answered immediately
+        that the command is busy
+
+    queue_timeout : float
+        Maximum time, in seconds, a request waits to be executed, after
+        which it is answered that the command is busy
+
+    idle_timeout : float
+        Time, in seconds, after which idle connections are closed, if
+        positive, otherwise connections are closed after every request
+
+    max_connections : int
+        Maximum number of connections open, per process, after which new
+        connections are rejected
+
+    metrics_port : int
+        If positive, port where to serve the metrics at /metrics, and the
+        admin routes: with multiple processes, each worker process uses a
+        different port, starting from this one
+
+    profile_dir : str
+        If not empty, directory where to save the profiles and memory
+        snapshots, which are taken upon signals or via the admin routes
+
+    profile_rate : float
+        Fraction of the requests profiled, once started
+
+    admin_token : str
+        Token needed to POST to the admin routes, disabled if empty
+    """
+
+    if mode not in MODES:
+        raise ValueError(f"Invalid serving mode: {mode}")
+    if workers <= 0:
+        raise ValueError(f"Invalid number of workers: {workers}")
+    if processes <= 0:
+        raise ValueError(f"Invalid number of processes: {processes}")
+    if command_limit < 0:
+        raise ValueError(f"Invalid command limit: {command_limit}")
+    if command_queue < 0:
+        raise ValueError(f"Invalid command queue: {command_queue}")
+    if queue_timeout < 0:
+        raise ValueError(f"Invalid queue timeout: {queue_timeout}")
+    if idle_timeout < 0:
+        raise ValueError(f"Invalid idle timeout: {idle_timeout}")
+    if max_connections <= 0:
+        raise ValueError(f"Invalid maximum number of connections: {max_connections}")
+
+    def serve_process(index=0):
+        _serve_process(
+            host,
+            port,
+            slash_commands() if callable(slash_commands) else slash_commands,
+            mode,
+            workers,
+            command_limit,
+            command_queue,
+            queue_timeout,
+            idle_timeout,
+            max_connections,
+            metrics_port + index if metrics_port > 0 else 0,
+            profile_dir,
+            profile_rate,
+            admin_token,
+            reuse_port=processes > 1,
+        )
+
+    if processes == 1:
+        serve_process()
+        return
+
+    if not callable(slash_commands):
+        raise ValueError(
+            "With multiple processes the slash commands must be created "
+            "by a function called in every worker process"
+        )
+    print(f"Starting {processes} worker processes, use <Ctrl-C> to stop")
+    forward = (signal.SIGUSR1, signal.SIGUSR2) if profile_dir else ()
+    supervise(processes, serve_process, forward)
+
+
+def _serve_process(
+    host,
+    port,
+    slash_commands,
+    mode,
+    workers,
+    command_limit,
+    command_queue,
+    queue_timeout,
+    idle_timeout,
+    max_connections,
+    metrics_port,
+    profile_dir,
+    profile_rate,
+    admin_token,
+    reuse_port=False,
+):
+    """Serve slash commands in the current process, see serve()"""
+
+    profiler = None
+    routes = dict()
+    if profile_dir:
+        profiler = Profiler(profile_dir, profile_rate)
+        handle_profiling_signals(profiler)
+        routes = {
+            "/profile/start": profiler.start_sampling,
+            "/profile/stop": profiler.stop_sampling,
+            "/memory/snapshot": profiler.take_snapshot,
+            "/memory/stop": profiler.stop_tracing,
+        }
+
+    dispatcher = Dispatcher(
+        slash_commands, profiler, command_limit, command_queue, queue_timeout
+    )
+
+    metrics_server = None
+    if metrics_port > 0:
+        metrics_server = metrics.serve_metrics(host, metrics_port, routes, admin_token)
+        print(f"Serving metrics at http://{host}:{metrics_port}/metrics")
+
+    print(f"Starting HTTP server at {host}:{port}, use <Ctrl-C> to stop")
+
+    if mode == "asyncio":
+        server = AsyncSlashServer(
+            (host, port),
+            dispatcher,
+            workers,
+            reuse_port,
+            idle_timeout,
+            max_connections,
+        )
+        asyncio.run(server.serve())
+
+    else:
+        # SIGTERM stops the server like <Ctrl-C> does
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        with PoolHTTPServer(
+            (host, port),
+            dispatcher,
+            workers,
+            reuse_port,
+            idle_timeout,
+            max_connections,
+        ) as server:
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+
+    for slash_command in slash_commands:
+        if slash_command.close is not None:
+            slash_command.close()
+
+    if metrics_server is not None:
+        metrics_server.shutdown()
+        metrics_server.server_close()